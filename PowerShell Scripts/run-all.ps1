@@ -2,13 +2,9 @@
 Write-Host "🚀 Starting Complete Threat Intelligence Pipeline" -ForegroundColor Cyan
 Write-Host "=" * 60 -ForegroundColor White
 
-# Step 1: Collect data
-Write-Host "`n1️⃣ COLLECTING DATA..." -ForegroundColor Yellow
-. .\collect.ps1
-
-# Step 2: Normalize data  
-Write-Host "`n2️⃣ NORMALIZING DATA..." -ForegroundColor Yellow
-. .\normalize.ps1
+# Steps 1+2: Collect and normalize data (src/collector.py replaces collect.ps1 + normalize.ps1)
+Write-Host "`n1️⃣ COLLECTING AND NORMALIZING DATA..." -ForegroundColor Yellow
+python -m src.collector
 
 # Step 3: Start API server
 Write-Host "`n3️⃣ STARTING API SERVER..." -ForegroundColor Yellow
@@ -0,0 +1 @@
+# Benchmark harness and synthetic dataset generator (see run.py)
@@ -0,0 +1,157 @@
+"""Write synthetic threats files for benchmarking.
+
+    python -m benchmarks.generate                  # 10k, 100k and 1m records
+    python -m benchmarks.generate 250k --seed 7 --output-dir /tmp/bench
+
+Records mimic what the collector produces (URLs, domains, IPs, networks
+and file hashes across several feeds and severities) and are a pure
+function of (index, seed), so the same command always writes the same
+file and the benchmark can regenerate any indicator it wants to query.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+DATA_DIR = 'benchmarks/data'
+DEFAULT_SIZES = ('10k', '100k', '1m')
+
+# Sightings are spread over this many days before END_TIME
+SPAN_DAYS = 90
+END_TIME = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# (type, share of records, feeds reporting it, descriptions)
+PROFILES = (
+    ('url', 40, ('urlhaus', 'threatfox', 'alienvault'),
+     ('Malicious URL', 'Malware distribution', 'Phishing page')),
+    ('domain', 25, ('alienvault', 'threatfox', 'abuse_ch', 'sample'),
+     ('Phishing domain', 'Botnet C2 domain', 'Malware distribution')),
+    ('ipv4', 18, ('feodotracker', 'abuse_ch', 'alienvault'),
+     ('Botnet C2 server', 'Scanning host', 'Brute force source')),
+    ('cidr', 2, ('spamhaus', 'alienvault'),
+     ('Hijacked netblock', 'Bulletproof hosting range')),
+    ('md5', 8, ('malwarebazaar', 'threatfox'),
+     ('Malware sample', 'Ransomware payload')),
+    ('sha256', 7, ('malwarebazaar', 'threatfox'),
+     ('Malware sample', 'Ransomware payload', 'Loader')),
+)
+SEVERITIES = (('high', 30), ('medium', 50), ('low', 20))
+
+_WORDS = ('secure', 'login', 'update', 'account', 'cdn', 'mail', 'verify', 'pay', 'cloud',
+          'support', 'files', 'download', 'service', 'portal', 'auth', 'online', 'app', 'web')
+_TLDS = ('com', 'net', 'org', 'info', 'xyz', 'top', 'ru', 'cn', 'io', 'biz', 'club', 'online')
+_PATHS = ('bins/x86', 'bins/arm7', 'payload.exe', 'invoice.doc', 'update.php', 'wp-admin/load.php',
+          'gate.php', 'files/setup.msi', 'login/index.html', 'dl/sample.zip')
+
+_TYPES = [profile for profile in PROFILES for _ in range(profile[1])]
+_SEVERITIES = [name for name, weight in SEVERITIES for _ in range(weight)]
+
+
+def parse_size(value):
+    """Record count for "250", "10k" or "1m"; raises ValueError"""
+    text = value.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    count = int(text[:-1] if scale > 1 else text)
+    if count < 1:
+        raise ValueError(f"Invalid size {value!r}")
+    return count * scale
+
+
+def size_label(count):
+    for suffix, scale in (('m', 1000000), ('k', 1000)):
+        if count % scale == 0:
+            return f'{count // scale}{suffix}'
+    return str(count)
+
+
+def _ipv4(number):
+    # Odd multiplier: distinct indexes map to distinct, scattered addresses
+    value = (number * 2654435761 + 0x0B000000) % 2 ** 32
+    return '.'.join(str(value >> shift & 255) for shift in (24, 16, 8, 0))
+
+
+def _domain(rng, number):
+    return f'{rng.choice(_WORDS)}-{rng.choice(_WORDS)}{number:x}.{rng.choice(_TLDS)}'
+
+
+def make_indicator(threat_type, rng, index):
+    if threat_type == 'url':
+        host = _ipv4(index) if rng.random() < 0.2 else _domain(rng, index)
+        return f'{rng.choice(("http", "https"))}://{host}/{rng.choice(_PATHS)}?id={index}'
+    if threat_type == 'domain':
+        return _domain(rng, index)
+    if threat_type == 'ipv4':
+        return _ipv4(index)
+    if threat_type == 'cidr':
+        return f"{_ipv4(index).rsplit('.', 1)[0]}.0/{rng.choice((22, 24, 24, 28))}"
+    digest = hashlib.md5 if threat_type == 'md5' else hashlib.sha256
+    return digest(f'sample-{index}'.encode()).hexdigest()
+
+
+def make_threat(index, seed=0):
+    """The synthetic threat at `index`; the same (index, seed) always gives the same record"""
+    rng = random.Random(index * 1000003 + seed)
+    threat_type, _, sources, descriptions = rng.choice(_TYPES)
+    first = END_TIME - timedelta(seconds=rng.randrange(SPAN_DAYS * 86400))
+    last = min(first + timedelta(seconds=rng.randrange(14 * 86400)), END_TIME)
+    return {
+        "indicator": make_indicator(threat_type, rng, index),
+        "type": threat_type,
+        "source": rng.choice(sources),
+        "severity": rng.choice(_SEVERITIES),
+        "confidence": rng.randrange(20, 101),
+        "description": rng.choice(descriptions),
+        "first_seen": first.isoformat(),
+        "last_seen": last.isoformat(),
+        "timestamp": last.isoformat(),
+    }
+
+
+def generate(count, seed=0):
+    """Yield `count` synthetic threats"""
+    for index in range(count):
+        yield make_threat(index, seed)
+
+
+def write_dataset(path, count, seed=0):
+    """Write `count` threats to `path` as a JSON array, one record per line"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for index, threat in enumerate(generate(count, seed)):
+            if index:
+                f.write(',\n')
+            f.write(json.dumps(threat))
+        f.write('\n]\n')
+    return path
+
+
+def dataset_path(count, output_dir=DATA_DIR, seed=0):
+    suffix = f'-seed{seed}' if seed else ''
+    return os.path.join(output_dir, f'threats-{size_label(count)}{suffix}.json')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', nargs='*', default=list(DEFAULT_SIZES),
+                        help="record counts, e.g. 10k 100k 1m")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    try:
+        counts = [parse_size(size) for size in args.sizes]
+    except ValueError as e:
+        parser.error(str(e))
+    for count in counts:
+        path = write_dataset(dataset_path(count, args.output_dir, args.seed), count, args.seed)
+        print(f"Wrote {count} threats to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
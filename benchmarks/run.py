@@ -0,0 +1,446 @@
+"""Benchmark the API against synthetic threats files.
+
+    python -m benchmarks.run                               # 10k and 100k, JSON store
+    python -m benchmarks.run 1m --backend sqlite --output results.json
+    python -m benchmarks.run 100k --baseline results.json  # flag regressions
+    python -m benchmarks.run 100k --url http://localhost:8080 --concurrency 64
+
+Each dataset (see benchmarks/generate.py; missing ones are generated) is
+benchmarked in a fresh subprocess against a private copy of the file, so
+load time and peak RSS are measured from a cold start and the writes
+never touch the generated data. Every scenario is first run alone through
+Flask's test client, then a weighted mix of them is run from several
+threads at once. With --url the same requests go over HTTP to a running
+server (e.g. `python -m src.app serve`) started on the same dataset;
+memory is then not measured.
+
+Results are written as JSON: per scenario the p50/p95/p99 latency,
+throughput and response bytes, plus load time and RSS per dataset. Given
+a previous report as --baseline, slower latencies, lower throughput or
+higher memory beyond --tolerance are listed and the exit status is 1.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # not on Windows: peak RSS is reported as null
+    resource = None
+
+from .generate import DATA_DIR, dataset_path, make_threat, parse_size, size_label, write_dataset
+
+DEFAULT_SIZES = ('10k', '100k')
+
+# Indicators per /api/lookup and /api/match request
+BATCH_SIZE = 100
+
+# Share of each scenario in the concurrent mix
+MIX = {
+    'data': 30,
+    'data_filtered': 25,
+    'stats': 10,
+    'lookup': 10,
+    'match': 10,
+    'trends': 5,
+    'add_threat': 10,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Workload:
+    """Requests for each scenario, built from a generated dataset's records"""
+
+    def __init__(self, count, seed=0):
+        self.count = count
+        self.seed = seed
+        # New indicators for add_threat, never in the dataset or repeated
+        self._new = itertools.count(count)
+
+    def _threat(self, rng):
+        return make_threat(rng.randrange(self.count), self.seed)
+
+    def _observable(self, threat):
+        indicator = threat['indicator']
+        if threat['type'] == 'domain':
+            return 'www.' + indicator
+        if threat['type'] == 'cidr':
+            return indicator.split('/')[0].rsplit('.', 1)[0] + '.1'
+        return indicator
+
+    def request(self, scenario, rng):
+        """(method, path, JSON body or None) for one request of `scenario`"""
+        if scenario == 'data':
+            return 'GET', '/api/data', None
+        if scenario == 'data_filtered':
+            field = rng.choice(('type', 'source', 'severity'))
+            query = {
+                field: self._threat(rng)[field],
+                'sort': rng.choice(('id', 'timestamp', 'confidence')),
+                'order': rng.choice(('asc', 'desc')),
+                'min_confidence': rng.randrange(20, 101),
+                'limit': 100,
+            }
+            return 'GET', '/api/data?' + urllib.parse.urlencode(query), None
+        if scenario == 'stats':
+            return 'GET', '/api/stats', None
+        if scenario == 'trends':
+            return 'GET', f"/api/trends?interval={rng.choice(('hour', 'day'))}&until=2026-01-01T00:00:00Z", None
+        if scenario == 'lookup':
+            # Half hits, half misses
+            indicators = [self._threat(rng)['indicator'] for _ in range(BATCH_SIZE // 2)]
+            indicators += [make_threat(self.count * 2 + rng.randrange(self.count), self.seed)['indicator']
+                           for _ in range(BATCH_SIZE - len(indicators))]
+            return 'POST', '/api/lookup', indicators
+        if scenario == 'match':
+            return 'POST', '/api/match', [self._observable(self._threat(rng)) for _ in range(BATCH_SIZE)]
+        if scenario == 'add_threat':
+            threat = make_threat(next(self._new), self.seed)
+            del threat['timestamp']
+            return 'POST', '/api/add_threat', threat
+        raise ValueError(f"Unknown scenario {scenario!r}")
+
+
+class TestClient:
+    """Requests through Flask's test client, in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+
+class HTTPClient:
+    """Requests over one keep-alive HTTP connection to a running server"""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+    def send(self, method, path, body):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        data = json.dumps(body).encode() if body is not None else None
+        self.connection.request(method, path, body=data, headers=headers)
+        response = self.connection.getresponse()
+        return response.status, len(response.read())
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summarize(samples, seconds):
+    """Latency percentiles (ms), throughput and sizes for [(latency, status, bytes)]"""
+    latencies = sorted(latency * 1000 for latency, _, _ in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, status, _ in samples if status >= 400),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(samples) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+        "mean_bytes": round(sum(size for _, _, size in samples) / len(samples)) if samples else None,
+    }
+
+
+def timed(client, request):
+    started = time.perf_counter()
+    status, size = client.send(*request)
+    return time.perf_counter() - started, status, size
+
+
+def run_scenario(client, workload, scenario, requests, warmup, rng):
+    for _ in range(warmup):
+        client.send(*workload.request(scenario, rng))
+    # Built up front so generating them is not measured
+    batch = [workload.request(scenario, rng) for _ in range(requests)]
+    started = time.perf_counter()
+    samples = [timed(client, request) for request in batch]
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_concurrent(new_client, workload, requests, concurrency, seed):
+    """Run `requests` mixed requests from `concurrency` threads; overall and per-scenario summaries"""
+    scenarios = [name for name, weight in MIX.items() for _ in range(weight)]
+    rng = random.Random(seed)
+    batch = []
+    for _ in range(requests):
+        scenario = rng.choice(scenarios)
+        batch.append((scenario, workload.request(scenario, rng)))
+    # Threads take the next request from a shared iterator until none are left
+    pending = iter(batch)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        client = new_client()
+        samples = []
+        for scenario, request in pending:
+            samples.append((scenario,) + timed(client, request))
+        with lock:
+            results.extend(samples)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    summary = summarize([sample[1:] for sample in results], seconds)
+    summary["concurrency"] = concurrency
+    summary["scenarios"] = {
+        name: summarize([sample[1:] for sample in results if sample[0] == name], seconds)
+        for name in MIX if any(sample[0] == name for sample in results)
+    }
+    return summary
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux only, else None)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / 1e6, 1)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS; either way MB of 10**6 bytes, as current_rss_mb() reports
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return round(peak / 1e6, 1)
+
+
+def prepare_store(source, directory, backend):
+    """Private copy of a dataset for the server to load (and write to)"""
+    if backend == 'json':
+        path = os.path.join(directory, 'threats.json')
+        shutil.copyfile(source, path)
+        return path
+    from src.jsonstream import iter_json_array
+    from src.sqlstore import SQLiteThreatStore
+    path = os.path.join(directory, 'threats.db')
+    # Streamed, so the JSON never sits in this process's memory (or RSS figures)
+    with open(source, 'rb') as f:
+        SQLiteThreatStore(path).replace(iter_json_array(f))
+    return path
+
+
+def bench_dataset(options):
+    """Benchmark one dataset in this (fresh) process; returns its result dict"""
+    count = parse_size(options.size)
+    source = dataset_path(count, options.data_dir, options.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['THREATS_STORE'] = prepare_store(source, directory, options.backend)
+        # No TTL policy: nothing expires while the benchmark runs
+        os.environ['THREATS_TTL'] = os.path.join(directory, 'ttl.json')
+        rss_before = current_rss_mb()
+        from src import app as server
+
+        started = time.perf_counter()
+        server.store.refresh()
+        load_seconds = time.perf_counter() - started
+        result = {
+            "dataset": size_label(count),
+            "backend": options.backend,
+            "records": server.store.stats()["total"],
+            "file_bytes": os.path.getsize(source),
+            "load_seconds": round(load_seconds, 3),
+            "rss_before_load_mb": rss_before,
+            "rss_after_load_mb": current_rss_mb(),
+        }
+
+        workload = Workload(count, options.seed)
+        rng = random.Random(options.seed)
+        client = TestClient(server.app)
+        result["scenarios"] = {
+            scenario: run_scenario(client, workload, scenario, options.requests, options.warmup, rng)
+            for scenario in MIX
+        }
+        result["concurrent"] = run_concurrent(lambda: TestClient(server.app), workload,
+                                              options.concurrent_requests, options.concurrency, options.seed)
+        result["rss_after_run_mb"] = current_rss_mb()
+        result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def bench_url(options, size):
+    """Benchmark a running server, which must be serving the generated dataset of `size`"""
+    count = parse_size(size)
+    workload = Workload(count, options.seed)
+    rng = random.Random(options.seed)
+    client = HTTPClient(options.url)
+    result = {"dataset": size_label(count), "backend": "http", "url": options.url}
+    result["scenarios"] = {
+        scenario: run_scenario(client, workload, scenario, options.requests, options.warmup, rng)
+        for scenario in MIX
+    }
+    result["concurrent"] = run_concurrent(lambda: HTTPClient(options.url), workload,
+                                          options.concurrent_requests, options.concurrency, options.seed)
+    return result
+
+
+def run_in_subprocess(options, size):
+    """bench_dataset() in a fresh interpreter, so load time and peak RSS are its own"""
+    with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+        command = [sys.executable, '-m', 'benchmarks.run', size, '--worker', output.name,
+                   '--backend', options.backend, '--seed', str(options.seed), '--data-dir', options.data_dir,
+                   '--requests', str(options.requests), '--warmup', str(options.warmup),
+                   '--concurrency', str(options.concurrency),
+                   '--concurrent-requests', str(options.concurrent_requests)]
+        completed = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            raise RuntimeError(f"benchmark of {size} failed with exit status {completed.returncode}")
+        return json.load(output)
+
+
+def regressions(baseline, report, tolerance):
+    """Human-readable list of metrics that got worse than `baseline` by more than `tolerance`"""
+    found = []
+    previous = {(result["dataset"], result["backend"]): result for result in baseline.get("results", [])}
+    for result in report["results"]:
+        before = previous.get((result["dataset"], result["backend"]))
+        if before is None:
+            continue
+        label = f'{result["dataset"]}/{result["backend"]}'
+
+        def check(name, old, new, higher_is_worse=True):
+            if old is None or new is None or old <= 0:
+                return
+            change = (new - old) / old
+            if change > tolerance if higher_is_worse else -change > tolerance:
+                found.append(f"{label} {name}: {old} -> {new} ({change:+.0%})")
+
+        for metric in ("load_seconds", "peak_rss_mb", "rss_after_load_mb"):
+            check(metric, before.get(metric), result.get(metric))
+        runs = dict(result["scenarios"], concurrent=result["concurrent"])
+        old_runs = dict(before.get("scenarios", {}), concurrent=before.get("concurrent", {}))
+        for scenario, summary in runs.items():
+            old = old_runs.get(scenario) or {}
+            check(f"{scenario} p95_ms", old.get("p95_ms"), summary.get("p95_ms"))
+            check(f"{scenario} throughput", old.get("throughput"), summary.get("throughput"),
+                  higher_is_worse=False)
+    return found
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    if "load_seconds" in result:
+        print(f'{result["dataset"]} ({result["backend"]}): load {result["load_seconds"]}s, '
+              f'peak RSS {result["peak_rss_mb"]} MB')
+    else:
+        print(f'{result["dataset"]} ({result["url"]})')
+    runs = dict(result["scenarios"], concurrent=result["concurrent"])
+    for scenario, summary in runs.items():
+        print(f'  {scenario:<14} p50 {summary["p50_ms"]:>9} ms  p95 {summary["p95_ms"]:>9} ms  '
+              f'p99 {summary["p99_ms"]:>9} ms  {summary["throughput"]:>9} req/s  {summary["errors"]} errors')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', nargs='*', default=list(DEFAULT_SIZES), help="datasets, e.g. 10k 100k 1m")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR, help="where generated datasets are kept")
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario")
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=16, help="threads in the mixed run")
+    parser.add_argument('--concurrent-requests', type=int, default=2000, help="requests in the mixed run")
+    parser.add_argument('--url', help="benchmark a running server instead of the test client")
+    parser.add_argument('--output', help="write the JSON report here (default: stdout)")
+    parser.add_argument('--baseline', help="previous report to flag regressions against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative slowdown (0.2 = 20%%)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    try:
+        counts = [parse_size(size) for size in options.sizes]
+    except ValueError as e:
+        parser.error(str(e))
+
+    if options.worker:
+        options.size = options.sizes[0]
+        result = bench_dataset(options)
+        with open(options.worker, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    results = []
+    for size, count in zip(options.sizes, counts):
+        if options.url:
+            result = bench_url(options, size)
+        else:
+            path = dataset_path(count, options.data_dir, options.seed)
+            if not os.path.exists(path):
+                print(f"Generating {path}...", file=sys.stderr)
+                write_dataset(path, count, options.seed)
+            result = run_in_subprocess(options, size)
+        if options.output:
+            print_result(result)
+        results.append(result)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "requests": options.requests, "warmup": options.warmup, "concurrency": options.concurrency,
+            "concurrent_requests": options.concurrent_requests, "seed": options.seed, "mix": MIX,
+        },
+        "results": results,
+    }
+    if options.baseline:
+        with open(options.baseline) as f:
+            report["regressions"] = regressions(json.load(f), report, options.tolerance)
+        for regression in report["regressions"]:
+            print(f"Regression: {regression}", file=sys.stderr)
+
+    body = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(body + '\n')
+    else:
+        print(body)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+from collections import Counter
+
+# ThreatAggregates counters, by attribute name
+COUNTERS = ('types', 'sources', 'severities', 'confidence', 'source_types')
+
+CONFIDENCE_LABELS = {'low': 25, 'medium': 50, 'high': 75}
+
+
+def confidence_value(confidence):
+    """Numeric confidence for sorting/filtering; labels map to 25/50/75, missing to -1"""
+    if isinstance(confidence, str):
+        label = confidence.strip().lower()
+        if label in CONFIDENCE_LABELS:
+            return CONFIDENCE_LABELS[label]
+        try:
+            confidence = float(label)
+        except ValueError:
+            return -1
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        return -1
+    if confidence != confidence:
+        return -1
+    return confidence
+
+
+def confidence_bucket(confidence):
+    """Map a confidence value (0-100 or low/medium/high) to a bucket label"""
+    if isinstance(confidence, str):
+        label = confidence.strip().lower()
+        if label in ('low', 'medium', 'high'):
+            return label
+        try:
+            confidence = float(label)
+        except ValueError:
+            return 'unknown'
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        return 'unknown'
+    if confidence >= 75:
+        return '75-100'
+    if confidence >= 50:
+        return '50-74'
+    if confidence >= 25:
+        return '25-49'
+    return '0-24'
+
+
+class ThreatAggregates:
+    """Running counters over the threat set.
+
+    add()/remove() are O(1) per threat so the store can keep them current
+    on every write; rebuild() recomputes everything in a single pass after
+    a reload.
+    """
+
+    fields = ('type', 'source', 'severity', 'confidence')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.types = Counter()
+        self.sources = Counter()
+        self.severities = Counter()
+        self.confidence = Counter()
+        self.source_types = Counter()
+
+    def rebuild(self, items):
+        self.reset()
+        keys = [self._keys(threat) for _, threat in items]
+        self.total = len(keys)
+        self.types.update(k[0] for k in keys)
+        self.sources.update(k[1] for k in keys)
+        self.severities.update(k[2] for k in keys)
+        self.confidence.update(k[3] for k in keys)
+        self.source_types.update(k[4] for k in keys)
+
+    def _keys(self, threat):
+        threat_type = threat.get('type') or 'unknown'
+        source = threat.get('source') or 'unknown'
+        return (
+            threat_type,
+            source,
+            threat.get('severity') or 'unknown',
+            confidence_bucket(threat.get('confidence')),
+            (source, threat_type),
+        )
+
+    def add(self, threat_id, threat):
+        threat_type, source, severity, bucket, pair = self._keys(threat)
+        self.total += 1
+        self.types[threat_type] += 1
+        self.sources[source] += 1
+        self.severities[severity] += 1
+        self.confidence[bucket] += 1
+        self.source_types[pair] += 1
+
+    def remove(self, threat_id, threat):
+        threat_type, source, severity, bucket, pair = self._keys(threat)
+        self.total -= 1
+        for counter, key in ((self.types, threat_type), (self.sources, source),
+                             (self.severities, severity), (self.confidence, bucket),
+                             (self.source_types, pair)):
+            counter[key] -= 1
+            if counter[key] <= 0:
+                del counter[key]
+
+    def dump(self):
+        """Copy the counters for a binary snapshot; returns a function giving its sections"""
+        sections = {'total': self.total}
+        for name in COUNTERS:
+            sections[name] = list(getattr(self, name).items())
+        return lambda: sections
+
+    def restore(self, sections, records):
+        """Load what dump() saved; returns True"""
+        self.total = sections['total']
+        for name in COUNTERS:
+            # JSON turns the (source, type) keys into lists
+            setattr(self, name, Counter({tuple(key) if isinstance(key, list) else key: count
+                                         for key, count in sections[name]}))
+        return True
+
+    def snapshot(self):
+        """Plain-dict copy suitable for JSON responses"""
+        source_types = {}
+        for (source, threat_type), count in self.source_types.items():
+            source_types.setdefault(source, {})[threat_type] = count
+        return {
+            "total": self.total,
+            "types": dict(self.types),
+            "sources": dict(self.sources),
+            "severities": dict(self.severities),
+            "confidence": dict(self.confidence),
+            "source_types": source_types,
+        }
@@ -1,65 +1,172 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
+import argparse
+import io
 import json
 import os
-from datetime import datetime
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+if __package__ in (None, ''):
+    # Allow `python src/app.py` as well as `python -m src.app`
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cache import ResponseCache
+from src.canonical import threat_error
+from src.expiry import TTL_FILE, TTLPolicy, parse_time, start_sweeper
+from src.jsonstream import CHUNK_SIZE, iter_json_array
+from src.metrics import REGISTRY, SIZE_BUCKETS, STORE_ERRORS, Counter, Gauge, Histogram
+from src.server import DEFAULT_THREADS, serve, stream_limit
+from src.store import THREATS_FILE, open_store
 
 app = Flask(__name__)
 CORS(app)
 
-THREATS_FILE = 'data/processed/threats.json'
+# Seconds an idle /api/stream connection waits before re-checking the files and sending a keepalive
+STREAM_KEEPALIVE = 15
+
+# Open /api/stream connections per process; `serve` lowers it to what its
+# threads allow (see stream_limit()). Clients turned away poll /api/data.
+MAX_STREAMS = 100
+# Retry-After, in seconds, for a stream request turned away
+STREAM_RETRY_AFTER = 60
+
+# Static pages are served with a long max-age; clients revalidate by ETag afterwards
+PAGE_MAX_AGE = 24 * 60 * 60
+
+# Request bodies read line by line by /api/lookup and /api/add_threats
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'text/plain')
+
+# Threats /api/add_threats commits per journal write (?batch_size= overrides it)
+INGEST_BATCH_SIZE = 5000
+# Per-line errors listed in an /api/add_threats response; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# A .db path selects the SQLite backend; THREATS_TTL points at the expiry policy
+store = open_store(os.environ.get('THREATS_STORE', THREATS_FILE),
+                   ttl=TTLPolicy.load(os.environ.get('THREATS_TTL', TTL_FILE)))
+response_cache = ResponseCache()
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time to produce a response (streams: until the first byte)',
+    ('method', 'route')))
+RESPONSE_BYTES = REGISTRY.register(Histogram(
+    'http_response_size_bytes', 'Response body sizes, as sent', ('method', 'route'), SIZE_BUCKETS))
+SERIALIZE_SECONDS = REGISTRY.register(Histogram(
+    'http_response_serialize_seconds', 'Time spent encoding JSON response bodies', ('route',)))
+
+def collect_file_sizes():
+    sizes = {}
+    for role, path in store.files().items():
+        try:
+            sizes[(role,)] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
+
+def collect_cache_hit_ratio():
+    lookups = response_cache.hits + response_cache.misses
+    return response_cache.hits / lookups if lookups else 0.0
+
+def collect_journal(attribute):
+    journal = getattr(store, 'journal', None)
+    return getattr(journal, attribute) if journal else None
+
+REGISTRY.register(Gauge('threats_indicators', 'Threats in the store',
+                        collect=lambda: store.stats()["total"] if store.document is None else None))
+REGISTRY.register(Gauge('threats_store_version', 'Store version, bumped by every change',
+                        collect=lambda: store.version or 0))
+REGISTRY.register(Gauge('threats_store_file_bytes', 'Size of the store files on disk', ('file',),
+                        collect=collect_file_sizes))
+REGISTRY.register(Gauge('threats_journal_entries', 'Operations in the journal since the last compaction',
+                        collect=lambda: collect_journal('entries')))
+REGISTRY.register(Gauge('threats_journal_bytes', 'Journal size since the last compaction',
+                        collect=lambda: collect_journal('size')))
+REGISTRY.register(Gauge('threats_response_cache_hit_ratio', 'Response cache hits per lookup',
+                        collect=collect_cache_hit_ratio))
+REGISTRY.register(Counter('threats_response_cache_hits_total', 'Response cache hits',
+                          collect=lambda: response_cache.hits))
+REGISTRY.register(Counter('threats_response_cache_misses_total', 'Response cache misses',
+                          collect=lambda: response_cache.misses))
+REGISTRY.register(Gauge('threats_response_cache_entries', 'Bodies in the response cache',
+                        collect=lambda: len(response_cache)))
 
-def load_threat_data():
-    """Load threat data from JSON file"""
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route)
+    REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    if response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length, method=request.method, route=route)
+    return response
+
+def load_threat_data(**query):
+    """Load one page of threat data plus aggregates from the in-memory store"""
     try:
-        with open(THREATS_FILE, 'r') as f:
-            content = f.read().strip()
-            if not content:
-                return get_fallback_data()
-            data = json.loads(content)
-            
-            if isinstance(data, list):
-                return {
-                    "total": len(data),
-                    "types": count_threat_types(data),
-                    "sources": count_threat_sources(data),
-                    "threats": data[:10]
-                }
-            return data
-            
+        store.refresh()
+        if store.document is not None:
+            return store.document
+        if not store.loaded:
+            return get_fallback_data()
+        stats = store.stats()
+        threats, cursor = store.page(**query)
+        return {
+            "total": stats["total"],
+            "types": stats["types"],
+            "sources": stats["sources"],
+            "severities": stats["severities"],
+            "threats": threats,
+            "next": cursor
+        }
+    except ValueError:
+        raise
     except Exception as e:
+        STORE_ERRORS.inc(operation='load')
         print(f"Error loading data: {e}")
         return get_fallback_data()
 
+def parse_page_query(args):
+    """Translate /api/data query parameters into ThreatStore.page() arguments"""
+    query = {}
+    for name in ('after', 'sort', 'order', 'type', 'source', 'severity'):
+        if args.get(name):
+            query[name] = args[name]
+    try:
+        if 'limit' in args:
+            query['limit'] = int(args['limit'])
+        if 'min_confidence' in args:
+            query['min_confidence'] = float(args['min_confidence'])
+    except ValueError:
+        raise ValueError("limit and min_confidence must be numbers")
+    return query
+
 def save_threat_data(threats):
-    """Save threats to JSON file"""
+    """Replace all threats in the store and save them to the JSON file"""
     try:
-        with open(THREATS_FILE, 'w') as f:
-            json.dump(threats, f, indent=2)
+        store.replace(threats)
         return True
     except Exception as e:
+        STORE_ERRORS.inc(operation='save')
         print(f"Error saving data: {e}")
         return False
 
-def count_threat_types(threats):
-    types = {}
-    for threat in threats:
-        threat_type = threat.get('type', 'unknown')
-        types[threat_type] = types.get(threat_type, 0) + 1
-    return types
-
-def count_threat_sources(threats):
-    sources = {}
-    for threat in threats:
-        source = threat.get('source', 'unknown')
-        sources[source] = sources.get(source, 0) + 1
-    return sources
-
 def get_fallback_data():
     return {
         "total": 156,
         "types": {"malware": 67, "phishing": 45, "botnet": 28, "exploit": 16},
         "sources": {"alienvault": 72, "threatcrowd": 48, "abuse_ch": 36},
+        "severities": {"high": 51, "medium": 73, "low": 32},
         "threats": [
             {
                 "indicator": "malicious-domain.com", "type": "phishing", "source": "alienvault",
@@ -68,42 +175,359 @@ def get_fallback_data():
         ]
     }
 
+def conditional_response(build):
+    """Answer If-None-Match with 304 from the store's ETag, otherwise call build(tag)"""
+    tag = store.etag()
+    if request.if_none_match.contains_weak(tag):
+        response = app.response_class(status=304)
+    else:
+        response = build(tag)
+    response.set_etag(tag)
+    modified = store.last_modified()
+    if modified:
+        response.last_modified = datetime.fromtimestamp(modified, timezone.utc)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def cached_json(tag, build):
+    """JSON for build() from the response cache, keyed by endpoint, query string and store ETag"""
+    key = (request.endpoint, tuple(sorted(request.args.items(multi=True))), tag)
+    entry = response_cache.get(key)
+    if entry is None:
+        data = build()
+        with SERIALIZE_SECONDS.time(route=request.url_rule.rule):
+            body = app.json.dumps(data).encode('utf-8') + b'\n'
+        entry = response_cache.put(key, body, 'application/json')
+    return encoded_response(entry, key)
+
+def cached_page(html):
+    """Serve a static page precompressed, with a content-hash ETag and a long max-age.
+
+    Pages share the response cache (and its size bound and metrics) with
+    the API; a write clears them along with everything else, and the next
+    request re-encodes the page under the same ETag.
+    """
+    key = ('page', request.endpoint)
+    entry = response_cache.get(key)
+    if entry is None:
+        entry = response_cache.put(key, html.encode('utf-8'), 'text/html')
+    if request.if_none_match.contains_weak(entry.etag):
+        response = app.response_class(status=304)
+    else:
+        response = encoded_response(entry, key)
+    response.set_etag(entry.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = PAGE_MAX_AGE
+    return response.make_conditional(request)
+
+def encoded_response(entry, key):
+    """Response for the body cached under `key` in the best encoding the client accepts"""
+    encoding = request.accept_encodings.best_match(entry.available(), default='identity')
+    if encoding == 'identity':
+        body = entry.encodings['identity']
+    else:
+        body = response_cache.encode(key, entry, encoding)
+    response = app.response_class(body, mimetype=entry.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/api/data')
 def api_data():
-    data = load_threat_data()
-    return jsonify(data)
+    try:
+        query = parse_page_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def build(tag):
+        return cached_json(tag, lambda: load_threat_data(**query))
+
+    try:
+        return conditional_response(build)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def stream_message(event, seq, data):
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_changes(seq):
+    """Server-Sent Events for store changes after `seq`.
+
+    Adds, merges and expiries since the last message are batched into one
+    "threats" event ({"added": [...], "updated": [...], "removed": [...],
+    "stats": {...}}); "clear" and "reload" tell the client to refetch
+    /api/data.
+    """
+    yield "retry: 5000\n\n"
+    while True:
+        if not store.changes.wait(seq, STREAM_KEEPALIVE):
+            # Picks up files rewritten by other processes, which publishes a reload
+            store.refresh()
+            if store.changes.seq == seq:
+                yield ": keepalive\n\n"
+                continue
+        seq, events, complete = store.changes.since(seq)
+        resets = [i for i, event in enumerate(events) if event["type"] in ("clear", "reload")]
+        stats = store.stats()
+        summary = {key: stats[key] for key in ("total", "types", "sources", "severities")}
+        if not complete:
+            yield stream_message("reload", seq, {"stats": summary})
+            continue
+        if resets:
+            yield stream_message(events[resets[-1]]["type"], seq, {"stats": summary})
+            events = events[resets[-1] + 1:]
+        if events:
+            delta = {"added": [], "updated": [], "removed": [], "stats": summary}
+            groups = {"add": "added", "update": "updated", "remove": "removed"}
+            for event in events:
+                delta[groups[event["type"]]].append(event["threat"])
+            yield stream_message("threats", seq, delta)
+
+def limit_streams(count):
+    """Accept at most `count` open /api/stream connections in this process"""
+    global stream_slots
+    stream_slots = threading.BoundedSemaphore(count)
+
+@app.route('/api/stream')
+def api_stream():
+    slots = stream_slots
+    if not slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open streams; poll /api/data with If-None-Match instead"})
+        response.status_code = 503
+        response.retry_after = STREAM_RETRY_AFTER
+        return response
+    try:
+        response = stream_response()
+    except BaseException:
+        slots.release()
+        raise
+    # Runs when the server closes the response, including after a disconnect
+    response.call_on_close(slots.release)
+    return response
+
+def stream_response():
+    store.refresh()
+    try:
+        seq = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        seq = store.changes.seq
+    if seq > store.changes.seq:
+        # Resuming against a restarted server: start with a reload
+        seq = -1
+    return Response(stream_changes(seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stats')
+def api_stats():
+    store.refresh()
+    if not store.loaded or store.document is not None:
+        return jsonify({"error": "No threat list loaded"}), 404
+    return conditional_response(lambda tag: cached_json(tag, store.stats))
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/trends')
+def api_trends():
+    interval = request.args.get('interval', 'hour')
+    try:
+        buckets = int(request.args['buckets']) if 'buckets' in request.args else None
+    except ValueError:
+        return jsonify({"error": "buckets must be a number"}), 400
+    until = None
+    if request.args.get('until'):
+        until = parse_time(request.args['until'])
+        if until is None:
+            return jsonify({"error": "until must be an ISO 8601 timestamp"}), 400
+    try:
+        series = store.trends(interval, buckets, until)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"interval": interval, "buckets": series})
+
+def request_lines():
+    """The request body line by line; request.stream alone would be read a byte at a time"""
+    return io.BufferedReader(request.stream, CHUNK_SIZE)
+
+def iter_lookup_indicators():
+    """Indicators from a JSON array body, or line by line from an NDJSON/plain-text stream"""
+    if request.mimetype in NDJSON_MIMETYPES:
+        values = (parse_lookup_line(line) for line in request_lines())
+    else:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            body = body.get('indicators')
+        if not isinstance(body, list):
+            raise ValueError("Expected a JSON array of indicators or an NDJSON body")
+        values = iter(body)
+    for value in values:
+        if isinstance(value, dict):
+            value = value.get('indicator')
+        if isinstance(value, str) and value.strip():
+            yield value.strip()
+
+def parse_lookup_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line.decode('utf-8', 'replace')
+
+def batch_search(search, describe):
+    """Run a store search over the request's indicators and report hits, as /api/lookup does"""
+    started = time.perf_counter()
+    checked = 0
+
+    def counted(indicators):
+        nonlocal checked
+        for indicator in indicators:
+            checked += 1
+            yield indicator
+
+    try:
+        matches = [describe(*found) for found in search(counted(iter_lookup_indicators()))]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "checked": checked,
+        "matched": len(matches),
+        "matches": matches,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.route('/api/lookup', methods=['POST'])
+def lookup():
+    return batch_search(store.lookup, lambda indicator, threats: {"indicator": indicator, "threats": threats})
+
+@app.route('/api/match', methods=['POST'])
+def match():
+    def describe(observable, covering):
+        return {
+            "observable": observable,
+            "indicators": [{"indicator": indicator, "threats": threats} for indicator, threats in covering]
+        }
+
+    return batch_search(store.match, describe)
 
 @app.route('/api/add_threat', methods=['POST'])
 def add_threat():
     try:
         new_threat = request.get_json()
         
-        # Validate required fields
-        if not new_threat or not new_threat.get('indicator'):
-            return jsonify({"error": "Indicator is required"}), 400
-        
-        # Load existing threats
-        with open(THREATS_FILE, 'r') as f:
-            threats = json.load(f)
+        # Validate required fields, and that the store can index the rest
+        error = threat_error(new_threat) if new_threat else "Indicator is required"
+        if error:
+            return jsonify({"error": error}), 400
         
         # Add new threat with timestamp
         new_threat['timestamp'] = datetime.now().isoformat()
-        threats.append(new_threat)
-        
-        # Save updated threats
-        if save_threat_data(threats):
-            return jsonify({"success": True, "message": "Threat added successfully"})
-        else:
+        try:
+            store.add(new_threat)
+            response_cache.clear()
+        except OSError as e:
+            STORE_ERRORS.inc(operation='save')
+            print(f"Error saving data: {e}")
             return jsonify({"error": "Failed to save threat"}), 500
+        
+        return jsonify({"success": True, "message": "Threat added successfully"})
             
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def iter_ingest_records():
+    """(line number, record) from an NDJSON body or (item number, record) from a JSON array.
+
+    An NDJSON line that is not valid JSON yields its ValueError as the
+    record; a malformed JSON array raises, since parsing cannot resume.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        for number, line in enumerate(request_lines(), 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+    else:
+        yield from enumerate(iter_json_array(request.stream), 1)
+
+@app.route('/api/add_threats', methods=['POST'])
+def add_threats():
+    started = time.perf_counter()
+    try:
+        batch_size = int(request.args.get('batch_size', INGEST_BATCH_SIZE))
+    except ValueError:
+        batch_size = 0
+    if batch_size < 1:
+        return jsonify({"error": "batch_size must be a positive integer"}), 400
+    position = "line" if request.mimetype in NDJSON_MIMETYPES else "item"
+    received = ingested = rejected = batches = 0
+    errors = []
+    batch = []
+
+    def commit():
+        nonlocal ingested, batches
+        if not batch:
+            return
+        timestamp = datetime.now().isoformat()
+        for threat in batch:
+            threat['timestamp'] = timestamp
+        store.add_many(batch)
+        response_cache.clear()
+        ingested += len(batch)
+        batches += 1
+        batch.clear()
+
+    def result(status, error=None):
+        elapsed = time.perf_counter() - started
+        body = {
+            "success": status == 200,
+            "received": received,
+            "ingested": ingested,
+            "rejected": rejected,
+            "batches": batches,
+            "errors": errors,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "per_second": round(received / elapsed) if elapsed else received
+        }
+        if error:
+            body["error"] = error
+        return jsonify(body), status
+
+    try:
+        for number, record in iter_ingest_records():
+            received += 1
+            # Same checks as /api/add_threat, so nothing the store rejects reaches commit()
+            error = f"Invalid JSON: {record}" if isinstance(record, ValueError) else threat_error(record)
+            if error is None:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    commit()
+                continue
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({position: number, "error": error})
+        commit()
+    except OSError as e:
+        STORE_ERRORS.inc(operation='save')
+        print(f"Error saving data: {e}")
+        return result(500, "Failed to save threats")
+    except ValueError as e:
+        # Malformed JSON array, or a threats file that is not a list
+        return result(400, str(e))
+    return result(200)
+
 @app.route('/api/clear_threats', methods=['POST'])
 def clear_threats():
     try:
         # Reset to empty array
-        save_threat_data([])
+        store.clear()
+        response_cache.clear()
         return jsonify({"success": True, "message": "All threats cleared"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -115,6 +539,12 @@ def home():
     <p>Available endpoints:</p>
     <ul>
         <li><a href="/api/data">/api/data</a> - Threat data API</li>
+        <li><a href="/api/stats">/api/stats</a> - Aggregate counters</li>
+        <li><a href="/api/stream">/api/stream</a> - Live change feed (Server-Sent Events)</li>
+        <li><a href="/api/trends">/api/trends</a> - Hourly/daily counts by type, source and severity</li>
+        <li><a href="/metrics">/metrics</a> - Prometheus metrics</li>
+        <li>POST /api/add_threats - Bulk ingest (NDJSON or JSON array)</li>
+        <li>POST /api/match - Match IPs, hostnames and URLs against stored networks and domains</li>
         <li><a href="/dashboard">/dashboard</a> - Main Dashboard</li>
         <li><a href="/admin">/admin</a> - Admin Panel (Add threats)</li>
     </ul>
@@ -122,7 +552,7 @@ def home():
 
 @app.route('/dashboard')
 def dashboard():
-    return """
+    return cached_page("""
 <!DOCTYPE html>
 <html>
 <head>
@@ -221,10 +651,13 @@ def dashboard():
     <a href="/admin" class="admin-link">⚙️ Admin Panel</a>
 
     <script>
+        let currentThreats = [];
+
         async function loadThreatData() {
             try {
-                const response = await fetch('/api/data');
+                const response = await fetch('/api/data?order=desc');
                 const data = await response.json();
+                currentThreats = data.threats || [];
                 updateDashboard(data);
                 updateLastUpdated();
             } catch (error) {
@@ -237,11 +670,10 @@ def dashboard():
             document.getElementById('sourcesCount').textContent = Object.keys(data.sources || {}).length;
             
             const threats = data.threats || [];
-            const highRisk = threats.filter(t => t.severity === 'high').length;
-            const mediumRisk = threats.filter(t => t.severity === 'medium').length;
+            const severities = data.severities || {};
             
-            document.getElementById('highRisk').textContent = highRisk;
-            document.getElementById('mediumRisk').textContent = mediumRisk;
+            document.getElementById('highRisk').textContent = severities.high || 0;
+            document.getElementById('mediumRisk').textContent = severities.medium || 0;
             
             updateThreatList(threats);
             updateSources(data.sources);
@@ -297,6 +729,31 @@ def dashboard():
             `).join('');
         }
 
+        function applyDelta(delta) {
+            const changed = (delta.added || []).concat(delta.updated || []).reverse();
+            const indicators = new Set(changed.concat(delta.removed || []).map(t => t.indicator));
+            currentThreats = changed.concat(currentThreats.filter(t => !indicators.has(t.indicator))).slice(0, 10);
+            updateDashboard({ ...delta.stats, threats: currentThreats });
+            updateLastUpdated();
+        }
+
+        function connectStream() {
+            if (!window.EventSource) {
+                setInterval(loadThreatData, 10000);
+                return;
+            }
+            const source = new EventSource('/api/stream');
+            source.onerror = () => {
+                // Closed for good (the server has no free stream slots): poll instead
+                if (source.readyState === EventSource.CLOSED) {
+                    setInterval(loadThreatData, 10000);
+                }
+            };
+            source.addEventListener('threats', e => applyDelta(JSON.parse(e.data)));
+            source.addEventListener('clear', () => loadThreatData());
+            source.addEventListener('reload', () => loadThreatData());
+        }
+
         function updateLastUpdated() {
             document.getElementById('updateTime').textContent = new Date().toLocaleTimeString();
         }
@@ -306,15 +763,15 @@ def dashboard():
         }
 
         loadThreatData();
-        setInterval(loadThreatData, 10000);
+        connectStream();
     </script>
 </body>
 </html>
-    """
+    """)
 
 @app.route('/admin')
 def admin_panel():
-    return """
+    return cached_page("""
 <!DOCTYPE html>
 <html>
 <head>
@@ -458,12 +915,44 @@ def admin_panel():
     </script>
 </body>
 </html>
-    """
+    """)
+
+def start_worker(max_streams=MAX_STREAMS):
+    """Load the store and start expiring threats in a freshly started server worker"""
+    limit_streams(max_streams)
+    store.refresh()
+    start_sweeper(store)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Threat Intelligence Backend")
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help="production server with several worker processes")
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                              help="worker processes (default: one per core)")
+    serve_parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                              help="threads per worker; all but 4 can hold /api/stream connections")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        max_streams = stream_limit(args.threads)
+        print(f"🚀 Serving on http://{args.host}:{args.port} with {args.workers} workers "
+              f"({max_streams} live streams each)")
+        # Each worker loads the threat store right after it is forked
+        return serve(app, args.host, args.port, args.workers, args.threads,
+                     on_worker_start=lambda: start_worker(max_streams))
 
-if __name__ == '__main__':
     print("🚀 Starting Threat Intelligence Backend...")
     print("📍 http://localhost:8080")
     print("📊 API: http://localhost:8080/api/data")
     print("📈 Dashboard: http://localhost:8080/dashboard")
     print("⚙️  Admin Panel: http://localhost:8080/admin")
-    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Only in the reloader's child process, which is the one serving requests
+        start_sweeper(store)
+    app.run(host='0.0.0.0', port=8080, debug=True)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
\ No newline at end of file
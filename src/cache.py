@@ -0,0 +1,111 @@
+import collections
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+class CachedBody:
+    """A serialized response body plus its compressed encodings, built on first use"""
+
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.encodings = {'identity': body}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return sum(len(data) for data in self.encodings.values())
+
+    def available(self):
+        """Encodings a client may be offered for this body, best first"""
+        if len(self.encodings['identity']) < MIN_COMPRESS_SIZE:
+            return ['identity']
+        return (['br'] if brotli else []) + ['gzip', 'identity']
+
+    def encode(self, encoding):
+        """Return (data, created) for `encoding`, compressing at most once"""
+        data = self.encodings.get(encoding)
+        if data is not None:
+            return data, False
+        with self._lock:
+            data = self.encodings.get(encoding)
+            if data is not None:
+                return data, False
+            body = self.encodings['identity']
+            if encoding == 'br':
+                data = brotli.compress(body)
+            else:
+                data = gzip.compress(body, compresslevel=6, mtime=0)
+            self.encodings[encoding] = data
+            return data, True
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of serialized response bodies.
+
+    Callers key entries by everything the body depends on (endpoint,
+    query string, store ETag), so stale entries are never served; clear()
+    frees them eagerly when the data changes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        entry = CachedBody(body, mimetype)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._size += entry.size
+                self._evict()
+        return entry
+
+    def encode(self, key, entry, encoding):
+        """Body of `entry` in `encoding`, counting new encodings against the size bound"""
+        data, created = entry.encode(encoding)
+        if created:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._size += len(data)
+                    self._evict()
+        return data
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
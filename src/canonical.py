@@ -0,0 +1,171 @@
+import ipaddress
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+from .aggregates import confidence_value
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+HASH_LENGTHS = (32, 40, 64, 128)
+_HEX = set('0123456789abcdefABCDEF')
+_PERCENT = re.compile(r'%[0-9a-fA-F]{2}')
+# Already-canonical http(s) URLs (the bulk of feed data) skip urlsplit()
+_SIMPLE_URL = re.compile(r'https?://[a-z0-9-]+(?:\.[a-z0-9-]+)*(?:/[^%#\s]*)?')
+_UNRESERVED = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+
+# Fields the store's views key or group threats by, so they must hold plain values
+INDEXED_FIELDS = ('indicator', 'type', 'source', 'severity')
+_PLAIN = (str, int, float, bool)
+
+
+def canonicalize(indicator):
+    """Canonical form of an indicator, used as its deduplication key.
+
+    Hosts are lowercased with trailing dots, default ports and IDNA
+    differences removed; IPv4/IPv6 addresses and networks get their
+    compressed form; hex hashes are lowercased; URL paths have their
+    percent-encoding and dot segments normalized. Anything else is
+    returned stripped but otherwise untouched.
+    """
+    if not isinstance(indicator, str):
+        return None
+    value = indicator.strip()
+    if not value:
+        return None
+    if '://' in value:
+        return _canonical_url(value)
+    if len(value) in HASH_LENGTHS and _HEX.issuperset(value):
+        return value.lower()
+    return _canonical_host(value)
+
+
+def field_error(threat):
+    """Why the store cannot index a threat (e.g. a list where a string belongs), or None"""
+    if not isinstance(threat, dict):
+        return "Threat must be a JSON object"
+    get = threat.get
+    for field in INDEXED_FIELDS:
+        value = get(field)
+        if value is not None and not isinstance(value, _PLAIN):
+            return f"{field} must be a string"
+    sources = get('sources')
+    if sources is not None and not (isinstance(sources, list)
+                                    and all(s is None or isinstance(s, _PLAIN) for s in sources)):
+        return "sources must be a list of strings"
+    return None
+
+
+def threat_error(threat):
+    """Why a submitted threat is rejected, or None: field_error() plus a required indicator"""
+    if isinstance(threat, dict) and not threat.get('indicator'):
+        return "Indicator is required"
+    return field_error(threat)
+
+
+def _canonical_host(host):
+    if ':' in host or host[0].isdigit():
+        try:
+            if '/' in host:
+                return str(ipaddress.ip_network(host, strict=False))
+            return str(ipaddress.ip_address(host.strip('[]')))
+        except ValueError:
+            pass
+    host = host.lower().rstrip('.')
+    if not host.isascii():
+        try:
+            host = host.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass
+    return host
+
+
+def _canonical_url(value):
+    if _SIMPLE_URL.fullmatch(value) and '/.' not in value:
+        return value if value.count('/') > 2 else value + '/'
+    try:
+        parts = urlsplit(value)
+        port = parts.port
+    except ValueError:
+        return value
+    if not parts.hostname:
+        return value
+    scheme = parts.scheme.lower()
+    host = _canonical_host(parts.hostname)
+    netloc = f'[{host}]' if ':' in host else host
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc += f':{port}'
+    userinfo, at, _ = parts.netloc.rpartition('@')
+    if at:
+        netloc = f'{userinfo}@{netloc}'
+    path = _remove_dot_segments(_PERCENT.sub(_normalize_escape, parts.path)) or '/'
+    query = _PERCENT.sub(_normalize_escape, parts.query)
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group(0)[1:], 16))
+    return char if char in _UNRESERVED else match.group(0).upper()
+
+
+def _remove_dot_segments(path):
+    if '.' not in path:
+        return path
+    segments = path.split('/')
+    output = []
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment in ('.', '..'):
+            if segment == '..' and len(output) > 1:
+                output.pop()
+            if last:
+                output.append('')
+        else:
+            output.append(segment)
+    return '/'.join(output)
+
+
+def _time_key(value):
+    return str(value).replace(' ', 'T')
+
+
+def new_sighting(threat, indicator):
+    """First sighting of an indicator: canonical indicator plus sighting metadata"""
+    record = dict(threat, indicator=indicator)
+    source = record.get('source')
+    if source:
+        sources = record.get('sources')
+        if sources:
+            record['sources'] = sorted(set(map(str, sources)) | {str(source)})
+        else:
+            record['sources'] = [str(source)]
+    seen = record.get('first_seen') or record.get('timestamp')
+    if seen:
+        record['first_seen'] = seen
+        last = record.get('last_seen')
+        record['last_seen'] = max(last, seen, key=_time_key) if last else seen
+    return record
+
+
+def merge_sighting(existing, threat):
+    """Fold a repeat sighting into an existing record, returning a new record.
+
+    Sources accumulate, first_seen/last_seen widen, confidence keeps the
+    maximum and fields the existing record lacks are filled in.
+    """
+    sighting = new_sighting(threat, existing['indicator'])
+    merged = dict(sighting)
+    merged.update(existing)
+    sources = set(map(str, existing.get('sources') or [])) | set(sighting.get('sources') or [])
+    if sources:
+        merged['sources'] = sorted(sources)
+    firsts = [r['first_seen'] for r in (existing, sighting) if r.get('first_seen')]
+    if firsts:
+        merged['first_seen'] = min(firsts, key=_time_key)
+    lasts = [r['last_seen'] for r in (existing, sighting) if r.get('last_seen')]
+    if lasts:
+        merged['last_seen'] = max(lasts, key=_time_key)
+    if sighting.get('timestamp'):
+        merged['timestamp'] = max(filter(None, (existing.get('timestamp'), sighting['timestamp'])),
+                                  key=_time_key)
+    if confidence_value(sighting.get('confidence')) > confidence_value(existing.get('confidence')):
+        merged['confidence'] = sighting['confidence']
+    return merged
@@ -0,0 +1,36 @@
+import collections
+import threading
+
+
+class ChangeFeed:
+    """Bounded, sequence-numbered log of store changes that readers can wait on.
+
+    Events are dicts with a "type" of add, update, remove, clear or reload. Only
+    the most recent `maxlen` are kept; a reader that falls further behind
+    is told to reload instead of replaying the gap.
+    """
+
+    def __init__(self, maxlen=1000):
+        self.seq = 0
+        self._events = collections.deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+
+    def publish(self, event):
+        with self._cond:
+            self.seq += 1
+            self._events.append((self.seq, event))
+            self._cond.notify_all()
+
+    def since(self, seq):
+        """Return (latest seq, events after `seq`, complete); complete is False if some were dropped"""
+        with self._cond:
+            if seq >= self.seq:
+                return self.seq, [], True
+            oldest = self._events[0][0] if self._events else self.seq + 1
+            events = [event for s, event in self._events if s > seq]
+            return self.seq, events, oldest <= seq + 1
+
+    def wait(self, seq, timeout):
+        """Block until an event newer than `seq` exists or `timeout` seconds pass"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.seq > seq, timeout)
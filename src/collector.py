@@ -0,0 +1,264 @@
+"""Collect threat feeds and write them into the server's threat store.
+
+Replaces PowerShell Scripts/collect.ps1 + normalize.ps1:
+
+    python -m src.collector                         # all default feeds
+    python -m src.collector urlhaus sample --append
+    python -m src.collector urlhaus=tests/fixtures/urlhaus.csv
+
+A feed is given as `name` (fetched from its public URL) or `name=location`
+where location is another URL or a local file, so adapters can be run
+offline against fixture files.
+"""
+import argparse
+import csv
+import io
+import itertools
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from .canonical import threat_error
+from .jsonstream import iter_json_array, iter_ndjson
+from .store import THREATS_FILE, open_store
+
+FETCH_TIMEOUT = 30
+
+# Threats are handed from the feed threads to the store in batches this
+# big, with at most QUEUED_BATCHES of them waiting to be written
+BATCH_SIZE = 1000
+QUEUED_BATCHES = 8
+
+ADAPTERS = {}
+
+
+def register_adapter(cls):
+    """Class decorator making a FeedAdapter available by its name"""
+    ADAPTERS[cls.name] = cls
+    return cls
+
+
+class FeedAdapter:
+    """Base class for a threat feed.
+
+    Subclasses set `name` (and `url` for a default location) and implement
+    parse(stream), yielding threats in the schema served by /api/data:
+    indicator, type, source and optionally severity, confidence,
+    first_seen and description. Lines and records parse() has to drop are
+    counted in `skipped`.
+    """
+
+    name = None
+    url = None
+
+    def __init__(self, location=None):
+        self.location = location or self.url
+        self.skipped = 0
+
+    def open(self):
+        """Text stream over the feed; downloads are read incrementally, never buffered whole"""
+        if not self.location:
+            raise ValueError(f"feed '{self.name}' needs a location ({self.name}=url-or-path)")
+        if self.location.startswith(('http://', 'https://')):
+            response = urllib.request.urlopen(self.location, timeout=FETCH_TIMEOUT)
+            return io.TextIOWrapper(response, encoding='utf-8', errors='replace', newline='')
+        return open(self.location, 'r', encoding='utf-8', errors='replace', newline='')
+
+    def threats(self):
+        """Yield the feed's threats as they are parsed"""
+        with self.open() as stream:
+            yield from self.parse(stream)
+
+    def collect(self):
+        return list(self.threats())
+
+    def parse(self, stream):
+        raise NotImplementedError
+
+    def _valid(self, threat):
+        # Skip what the store would reject, rather than failing the whole feed
+        if threat_error(threat) is None:
+            return True
+        self.skipped += 1
+        return False
+
+
+@register_adapter
+class UrlhausAdapter(FeedAdapter):
+    """abuse.ch URLhaus recent URLs (CSV with '#' comment lines)"""
+
+    name = 'urlhaus'
+    url = 'https://urlhaus.abuse.ch/downloads/csv_recent/'
+
+    def parse(self, stream):
+        lines = (line for line in stream if line.strip() and not line.startswith('#'))
+        # id, dateadded, url, url_status, last_online, threat, tags, urlhaus_link, reporter
+        for row in csv.reader(lines):
+            if len(row) < 3 or not row[2]:
+                continue
+            yield {
+                "indicator": row[2],
+                "type": "url",
+                "source": "urlhaus",
+                "first_seen": row[1],
+                "description": "Malicious URL",
+            }
+
+
+@register_adapter
+class JsonFeedAdapter(FeedAdapter):
+    """Threats already in the served schema: NDJSON for .ndjson/.jsonl locations, else a JSON array"""
+
+    name = 'json'
+
+    def parse(self, stream):
+        if self.location.endswith(('.ndjson', '.jsonl')):
+            items = iter_ndjson(stream, invalid=self._invalid_line)
+        else:
+            items = iter_json_array(stream)
+        for item in items:
+            if self._valid(item):
+                item.setdefault('source', self.name)
+                yield item
+
+    def _invalid_line(self, line):
+        self.skipped += 1
+
+
+@register_adapter
+class SampleAdapter(FeedAdapter):
+    """Built-in demo indicators (formerly added by collect.ps1)"""
+
+    name = 'sample'
+
+    THREATS = [
+        {"indicator": "malicious-domain.com", "type": "domain", "confidence": "high"},
+        {"indicator": "192.168.1.100", "type": "ipv4", "confidence": "medium"},
+        {"indicator": "http://evil.com/payload.exe", "type": "url", "confidence": "high"},
+        {"indicator": "5d41402abc4b2a76b9719d911017c592", "type": "md5", "confidence": "medium"},
+        {"indicator": "bad-site.net", "type": "domain", "confidence": "high"},
+    ]
+
+    def threats(self):
+        if self.location is None:
+            return self.parse(self.THREATS)
+        return super().threats()
+
+    def parse(self, stream):
+        items = stream if isinstance(stream, list) else iter_json_array(stream)
+        for item in items:
+            if self._valid(item):
+                yield dict(item, source="sample")
+
+
+def build_adapters(specs):
+    """Turn `name` / `name=location` strings into adapter instances"""
+    adapters = []
+    for spec in specs:
+        name, _, location = spec.partition('=')
+        if name not in ADAPTERS:
+            raise ValueError(f"Unknown feed '{name}' (available: {', '.join(sorted(ADAPTERS))})")
+        adapters.append(ADAPTERS[name](location or None))
+    return adapters
+
+
+def collect_feeds(adapters, workers=4, batch_size=BATCH_SIZE):
+    """Fetch and parse feeds concurrently, yielding lists of normalized threats as they are parsed.
+
+    Feeds are never held whole: a feed thread waits while QUEUED_BATCHES
+    batches are waiting for the caller. A feed that fails part way keeps
+    the threats it yielded before the error.
+    """
+    batches = queue.Queue(QUEUED_BATCHES)
+    stopped = threading.Event()
+
+    def put(batch):
+        # Gives up once the caller has stopped reading
+        while not stopped.is_set():
+            try:
+                batches.put(batch, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(adapter):
+        started, found = time.perf_counter(), 0
+        try:
+            threats = adapter.threats()
+            while True:
+                batch = list(itertools.islice(threats, batch_size))
+                if not batch or not put(batch):
+                    break
+                found += len(batch)
+        except Exception as e:
+            print(f"{adapter.name} failed: {e}")
+        else:
+            skipped = f", skipped {adapter.skipped} invalid" if adapter.skipped else ""
+            print(f"Found {found} indicators from {adapter.name} "
+                  f"in {time.perf_counter() - started:.1f}s{skipped}")
+        finally:
+            put(None)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        for adapter in adapters:
+            pool.submit(run, adapter)
+        running = len(adapters)
+        while running:
+            batch = batches.get()
+            if batch is None:
+                running -= 1
+            else:
+                yield batch
+    finally:
+        stopped.set()
+        pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('feeds', nargs='*', default=['urlhaus', 'sample'],
+                        help="feeds to collect, as name or name=url-or-path")
+    parser.add_argument('--output', default=THREATS_FILE, help="threats file (or .db database) to write")
+    parser.add_argument('--append', action='store_true',
+                        help="add to the existing threats instead of replacing them")
+    parser.add_argument('--workers', type=int, default=4, help="feeds fetched in parallel")
+    args = parser.parse_args(argv)
+
+    try:
+        adapters = build_adapters(args.feeds)
+    except ValueError as e:
+        parser.error(str(e))
+    print("Collecting threat data from public feeds...")
+    batches = collect_feeds(adapters, args.workers)
+    first = next(batches, None)
+    if first is None and not args.append:
+        print("No data collected")
+        return 1
+    batches = itertools.chain([first] if first else [], batches)
+    saved = 0
+
+    def threats():
+        nonlocal saved
+        for batch in batches:
+            saved += len(batch)
+            yield from batch
+
+    store = open_store(args.output)
+    if args.append:
+        # One journal write per batch as the feeds are parsed
+        for batch in batches:
+            store.add_many(batch)
+            saved += len(batch)
+    else:
+        # Written to the snapshot as the feeds are parsed
+        store.replace(threats())
+    print(f"Saved {saved} indicators to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
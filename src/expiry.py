@@ -0,0 +1,199 @@
+import heapq
+import json
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+
+TTL_FILE = 'data/ttl.json'
+
+# Longest the sweeper sleeps between checks; it wakes earlier when the
+# next expiry is due sooner, and no more often than SWEEP_MIN_DELAY.
+SWEEP_INTERVAL = 60
+SWEEP_MIN_DELAY = 1
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_time(value):
+    """Epoch seconds for an ISO 8601 timestamp (naive ones are local time), or None"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.strip()).timestamp()
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def parse_duration(value):
+    """Seconds for a number of seconds or a string like "12h" / "7d" / "2w"; raises ValueError"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        return value
+    if isinstance(value, str) and value[-1:].lower() in _UNITS:
+        try:
+            amount = float(value[:-1])
+        except ValueError:
+            amount = 0
+        if amount > 0:
+            return amount * _UNITS[value[-1].lower()]
+    raise ValueError(f"Invalid duration {value!r} (use seconds or e.g. '12h', '7d')")
+
+
+class TTLPolicy:
+    """How long indicators live, by source and by type.
+
+    Read from a JSON file such as
+
+        {"default": "90d", "sources": {"urlhaus": "30d"}, "types": {"ipv4": "7d"}}
+
+    An indicator expires its TTL after it was last seen; when several
+    policies apply (the default, any of its sources, its type) the
+    shortest wins. Indicators no policy applies to never expire.
+    """
+
+    def __init__(self, default=None, sources=None, types=None):
+        self.default = parse_duration(default) if default is not None else None
+        self.sources = {name: parse_duration(ttl) for name, ttl in (sources or {}).items()}
+        self.types = {name: parse_duration(ttl) for name, ttl in (types or {}).items()}
+
+    @classmethod
+    def load(cls, path=TTL_FILE):
+        """Policy from a JSON file; no file means nothing expires"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as f:
+            config = json.load(f)
+        return cls(config.get('default'), config.get('sources'), config.get('types'))
+
+    def config(self):
+        """The policy as a JSON-compatible dict, in seconds"""
+        return {"default": self.default, "sources": self.sources, "types": self.types}
+
+    def __bool__(self):
+        return self.default is not None or bool(self.sources) or bool(self.types)
+
+    def ttl(self, threat):
+        ttls = [self.types.get(threat.get('type'))]
+        for source in threat.get('sources') or [threat.get('source')]:
+            ttls.append(self.sources.get(source))
+        ttls = [ttl for ttl in ttls if ttl is not None]
+        return min(ttls) if ttls else self.default
+
+    def expires_at(self, threat):
+        """Epoch seconds when `threat` expires, or None if it does not"""
+        ttl = self.ttl(threat)
+        if ttl is None:
+            return None
+        seen = parse_time(threat.get('last_seen') or threat.get('timestamp') or threat.get('first_seen'))
+        return seen + ttl if seen is not None else None
+
+
+class ExpiryQueue:
+    """Min-heap of threat expiry times, kept as a store view.
+
+    The earliest expiry is always at the top, so a sweep only touches the
+    threats that are due. A merge that extends a threat's life pushes a
+    new entry; the superseded one is skipped when it reaches the top.
+    """
+
+    fields = ('indicator', 'type', 'source', 'sources', 'last_seen', 'timestamp', 'first_seen')
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.reset()
+
+    def reset(self):
+        self._heap = []
+        self._expires = {}
+
+    def _expiry(self, threat):
+        indicator = threat.get('indicator')
+        if not isinstance(indicator, str) or not indicator.strip():
+            # Without an indicator the store has no key to remove it by
+            return None
+        return self.policy.expires_at(threat)
+
+    def rebuild(self, items):
+        self.reset()
+        if not self.policy:
+            return
+        for threat_id, threat in items:
+            expires = self._expiry(threat)
+            if expires is not None:
+                self._expires[threat_id] = expires
+        self._heapify()
+
+    def _heapify(self):
+        self._heap = [(expires, threat_id) for threat_id, expires in self._expires.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, threat_id, threat):
+        if not self.policy:
+            return
+        expires = self._expiry(threat)
+        if expires is None:
+            return
+        self._expires[threat_id] = expires
+        heapq.heappush(self._heap, (expires, threat_id))
+        if len(self._heap) > 2 * len(self._expires) + 1024:
+            self._heapify()
+
+    def remove(self, threat_id, threat):
+        self._expires.pop(threat_id, None)
+
+    def dump(self):
+        """Copy the expiry times for a binary snapshot; returns a function giving its sections"""
+        sections = {
+            'policy': self.policy.config(),
+            'ids': array('I', self._expires),
+            'expires': array('d', self._expires.values()),
+        }
+        return lambda: sections
+
+    def restore(self, sections, records):
+        """Load what dump() saved; returns False (to be rebuilt) if the TTL policy changed since"""
+        if sections['policy'] != self.policy.config():
+            return False
+        self._expires = dict(zip(sections['ids'], sections['expires']))
+        self._heapify()
+        return True
+
+    def __len__(self):
+        return len(self._expires)
+
+    def next_expiry(self):
+        """Earliest pending expiry time, or None"""
+        heap = self._heap
+        while heap and self._expires.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def due(self, now):
+        """Pop and return the ids of threats expiring at or before `now`"""
+        ids = []
+        while True:
+            expires = self.next_expiry()
+            if expires is None or expires > now:
+                return ids
+            _, threat_id = heapq.heappop(self._heap)
+            del self._expires[threat_id]
+            ids.append(threat_id)
+
+
+def start_sweeper(store, interval=SWEEP_INTERVAL):
+    """Run store.expire() in a daemon thread, waking when the next expiry is due"""
+    def sweep():
+        while True:
+            try:
+                store.expire()
+                next_expiry = store.next_expiry()
+            except Exception as e:
+                print(f"Error expiring threats: {e}")
+                next_expiry = None
+            delay = interval if next_expiry is None else min(interval, next_expiry - time.time())
+            time.sleep(max(delay, SWEEP_MIN_DELAY))
+
+    thread = threading.Thread(target=sweep, name='threat-expiry', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,334 @@
+import base64
+import binascii
+import bisect
+import heapq
+import json
+import math
+from array import array
+
+from .aggregates import confidence_value
+from .records import Interner, TextColumn, TextHeap
+
+FILTER_FIELDS = ('type', 'source', 'severity')
+SORT_FIELDS = ('id', 'timestamp', 'confidence')
+DEFAULT_ORDER = {'id': 'asc', 'timestamp': 'desc', 'confidence': 'desc'}
+MAX_PAGE_SIZE = 1000
+
+# Timestamp sort keys are cut to this many characters; nothing real comes close
+TIMESTAMP_KEY_CHARS = 0xFFFF // 4
+
+# Confidence band bounds for the id and timestamp lists: below 0 (none
+# given), each ten up to 100, exactly 100, and above 100
+CONFIDENCE_BANDS = tuple(range(0, 101, 10)) + (math.nextafter(100, math.inf),)
+
+
+def encode_cursor(sort, key):
+    raw = json.dumps([sort] + list(key), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(sort, token):
+    """Turn an `after` token back into an index key, raising ValueError if it is not for `sort`"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value = json.loads(raw)
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(value, list) or len(value) < 2 or value[0] != sort:
+        raise ValueError("Cursor does not match sort order")
+    key = tuple(value[1:])
+    if not isinstance(key[-1], int):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def check_page_query(limit, sort, order):
+    """Validate paging arguments, returning the effective order"""
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+    order = order or DEFAULT_ORDER[sort]
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return order
+
+
+def timestamp_key(threat):
+    # Cut so that its UTF-8 (at most 4 bytes a character) always fits a TextColumn
+    return str(threat.get('timestamp') or threat.get('first_seen') or '')[:TIMESTAMP_KEY_CHARS]
+
+
+def _number(value):
+    # Whole confidences come back from the double array as floats; keep cursors as before
+    return int(value) if value.is_integer() else value
+
+
+def confidence_band(confidence):
+    return bisect.bisect_right(CONFIDENCE_BANDS, confidence)
+
+
+def _bands(min_confidence):
+    """(band, whether its threats need checking) for every band that can meet min_confidence"""
+    bands = []
+    for band in range(len(CONFIDENCE_BANDS) + 1):
+        lower = CONFIDENCE_BANDS[band - 1] if band else -math.inf
+        upper = CONFIDENCE_BANDS[band] if band < len(CONFIDENCE_BANDS) else None
+        if min_confidence is None:
+            bands.append((band, False))
+        elif upper is None or upper > min_confidence:
+            bands.append((band, lower < min_confidence))
+    return bands
+
+
+def _bisect_left(ids, key, target):
+    lo, hi = 0, len(ids)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(ids[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _bisect_right(ids, key, target):
+    lo, hi = 0, len(ids)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if target < key(ids[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class ThreatIndex:
+    """Sorted secondary indexes for paging through the store.
+
+    For every sort order there is one sorted list of threat ids over all
+    threats, one per filter value (type, source, severity) and one per
+    combination of all three values. The id and timestamp lists are each
+    split further by confidence band (see CONFIDENCE_BANDS), so a threat
+    is still in one list per partition. Ids are ordered by their key -
+    (id,), (timestamp, id) or (confidence, id) - which is unique, so a
+    cursor is just the last key returned.
+
+    The lists are arrays of ints; keys are not stored but looked up per id
+    while bisecting, from per-id arrays of confidences, packed timestamp
+    strings and interned filter values.
+
+    A page is served by bisecting the applicable list to the cursor and
+    walking it, so a page costs O(log n + page size). Two or three filters
+    merge the lists of every combination that matches them, and sorting by
+    id or timestamp merges the lists of every band, adding a factor of the
+    number of distinct combinations and bands, which does not grow with n.
+    min_confidence is a range bound when sorting by confidence; otherwise
+    it leaves out the bands below it, and only threats in the band it
+    falls inside are checked while walking.
+    """
+
+    fields = ('type', 'source', 'severity', 'confidence', 'timestamp', 'first_seen')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Per threat id; filter code 0 marks an id that is not indexed
+        self._filters = array('I')
+        self._filter_table = Interner()
+        self._confidence = array('d')
+        self._heap = TextHeap()
+        self._timestamps = TextColumn(self._heap)
+        self._lists = {}
+
+    def _sort_key(self, sort):
+        if sort == 'timestamp':
+            get = self._timestamps.get
+            return lambda threat_id: (get(threat_id), threat_id)
+        if sort == 'confidence':
+            confidence = self._confidence
+            return lambda threat_id: (_number(confidence[threat_id]), threat_id)
+        return lambda threat_id: (threat_id,)
+
+    def _filter_values(self, threat):
+        get = threat.get
+        return (get('type') or 'unknown', get('source') or 'unknown', get('severity') or 'unknown')
+
+    def _partitions(self, values):
+        yield None, None
+        yield from zip(FILTER_FIELDS, values)
+        yield 'filters', values
+
+    def _set_entry(self, threat_id, threat):
+        filters = self._filters
+        if threat_id >= len(filters):
+            count = threat_id + 1 - len(filters)
+            filters.frombytes(bytes(count * filters.itemsize))
+            self._confidence.frombytes(bytes(count * self._confidence.itemsize))
+            self._timestamps.grow(count)
+        filters[threat_id] = self._filter_table.code(self._filter_values(threat))
+        confidence = confidence_value(threat.get('confidence'))
+        try:
+            self._confidence[threat_id] = confidence
+        except OverflowError:
+            self._confidence[threat_id] = math.copysign(math.inf, confidence)
+        self._timestamps.set(threat_id, timestamp_key(threat))
+
+    def rebuild(self, items):
+        self.reset()
+        for threat_id, threat in items:
+            self._set_entry(threat_id, threat)
+        filters, values = self._filters, self._filter_table.values
+        ids = [threat_id for threat_id in range(len(filters)) if filters[threat_id]]
+        # Sort all ids once per order (stable, so ties stay in id order),
+        # then split the sorted ids into the per-value lists
+        for sort in SORT_FIELDS:
+            if sort == 'id':
+                ordered = ids
+            elif sort == 'timestamp':
+                ordered = sorted(ids, key=self._timestamps.get)
+            else:
+                ordered = sorted(ids, key=self._confidence.__getitem__)
+            targets = {}
+            for threat_id in ordered:
+                target = (filters[threat_id], self._band(sort, threat_id))
+                appends = targets.get(target)
+                if appends is None:
+                    appends = targets[target] = [self._id_list(field, value, sort, target[1]).append
+                                                 for field, value in self._partitions(values[target[0]])]
+                for append in appends:
+                    append(threat_id)
+
+    def dump(self):
+        """Copy the index for a binary snapshot; returns a function giving its sections"""
+        sections = {
+            'filters': array('I', self._filters),
+            'filter_table': self._filter_table.values[1:],
+            'confidence': array('d', self._confidence),
+            'heap': bytes(self._heap.data),
+            'timestamp_starts': array('I', self._timestamps.starts),
+            'timestamp_lengths': array('H', self._timestamps.lengths),
+            'lists': list(self._lists),
+        }
+        for i, id_list in enumerate(self._lists.values()):
+            sections[f'list{i}'] = array('I', id_list)
+        return lambda: sections
+
+    def restore(self, sections, records):
+        """Load what dump() saved; returns True"""
+        self.reset()
+        self._filters = sections['filters']
+        for values in sections['filter_table']:
+            self._filter_table.code(tuple(values))
+        self._confidence = sections['confidence']
+        self._heap.data = sections['heap']
+        self._timestamps.starts = sections['timestamp_starts']
+        self._timestamps.lengths = sections['timestamp_lengths']
+        for i, (field, value, sort, band) in enumerate(sections['lists']):
+            # JSON turns the 'filters' combinations into lists
+            if isinstance(value, list):
+                value = tuple(value)
+            self._lists[(field, value, sort, band)] = sections[f'list{i}']
+        return True
+
+    def _matching_lists(self, sort, wanted, min_confidence):
+        """(id list, whether to check min_confidence) for the lists that together
+        hold every threat matching the `wanted` filter values and min_confidence"""
+        given = [(field, value) for field, value in zip(FILTER_FIELDS, wanted) if value is not None]
+        if not given:
+            partitions = [(None, None)]
+        elif len(given) == 1:
+            partitions = given
+        else:
+            partitions = [('filters', values) for values in self._filter_table.values[1:]
+                          if all(w is None or w == v for w, v in zip(wanted, values))]
+        bands = [(None, False)] if sort == 'confidence' else _bands(min_confidence)
+        lists, matching = self._lists, []
+        for field, value in partitions:
+            for band, checked in bands:
+                id_list = lists.get((field, value, sort, band))
+                if id_list is not None:
+                    matching.append((id_list, checked))
+        return matching
+
+    def _positions(self, id_list, key, order, after_key, lower):
+        """Positions in id_list a page walks, in order: past the cursor and from key `lower` up"""
+        start = 0 if lower is None else _bisect_left(id_list, key, (lower,))
+        if order == 'asc':
+            if after_key is not None:
+                start = max(start, _bisect_right(id_list, key, after_key))
+            return range(start, len(id_list))
+        end = len(id_list) if after_key is None else _bisect_left(id_list, key, after_key)
+        return range(end - 1, start - 1, -1)
+
+    def _band(self, sort, threat_id):
+        # Lists sorted by confidence are not split into bands
+        return None if sort == 'confidence' else confidence_band(self._confidence[threat_id])
+
+    def _id_list(self, field, value, sort, band):
+        id_list = self._lists.get((field, value, sort, band))
+        if id_list is None:
+            id_list = self._lists[(field, value, sort, band)] = array('I')
+        return id_list
+
+    def add(self, threat_id, threat):
+        self._set_entry(threat_id, threat)
+        values = self._filter_table.values[self._filters[threat_id]]
+        for sort in SORT_FIELDS:
+            key = self._sort_key(sort)
+            threat_key, band = key(threat_id), self._band(sort, threat_id)
+            for field, value in self._partitions(values):
+                id_list = self._id_list(field, value, sort, band)
+                if not id_list or key(id_list[-1]) < threat_key:
+                    id_list.append(threat_id)
+                else:
+                    id_list.insert(_bisect_left(id_list, key, threat_key), threat_id)
+
+    def remove(self, threat_id, threat):
+        values = self._filter_table.values[self._filters[threat_id]]
+        for sort in SORT_FIELDS:
+            key = self._sort_key(sort)
+            threat_key, band = key(threat_id), self._band(sort, threat_id)
+            for field, value in self._partitions(values):
+                name = (field, value, sort, band)
+                id_list = self._lists[name]
+                i = _bisect_left(id_list, key, threat_key)
+                if i < len(id_list) and id_list[i] == threat_id:
+                    del id_list[i]
+                if not id_list:
+                    del self._lists[name]
+        self._filters[threat_id] = 0
+        self._timestamps.clear(threat_id)
+        self._heap.maybe_repack((self._timestamps,))
+
+    def page(self, limit=10, after=None, sort='id', order=None,
+             type=None, source=None, severity=None, min_confidence=None):
+        """Return (threat ids, next cursor or None) for one page"""
+        order = check_page_query(limit, sort, order)
+        after_key = decode_cursor(sort, after) if after else None
+
+        key = self._sort_key(sort)
+        lower = min_confidence if sort == 'confidence' else None
+        confidence = self._confidence
+        walks = []
+        try:
+            for id_list, checked in self._matching_lists(sort, (type, source, severity), min_confidence):
+                walk = map(id_list.__getitem__, self._positions(id_list, key, order, after_key, lower))
+                if checked:
+                    walk = (threat_id for threat_id in walk if confidence[threat_id] >= min_confidence)
+                walks.append(walk)
+        except TypeError:
+            raise ValueError("Cursor does not match sort order")
+        if len(walks) == 1:
+            walk = walks[0]
+        else:
+            walk = heapq.merge(*walks, key=key, reverse=order == 'desc')
+
+        ids, last_id = [], None
+        for threat_id in walk:
+            if len(ids) == limit:
+                return ids, encode_cursor(sort, key(last_id))
+            ids.append(threat_id)
+            last_id = threat_id
+        return ids, None
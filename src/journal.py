@@ -0,0 +1,313 @@
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: threads are still serialized, processes are not
+    fcntl = None
+
+
+def fsync_directory(path):
+    """Make a rename inside `path` durable (no-op where unsupported)"""
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data, rename=True, suffix='.tmp'):
+    """Write bytes or byte chunks to `path + suffix`, fsync it and (optionally) rename it into place"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + suffix
+    try:
+        with open(tmp_path, 'wb') as f:
+            if isinstance(data, (bytes, bytearray)):
+                f.write(data)
+            else:
+                f.writelines(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        # Chunks can come from a generator that fails part way
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if rename:
+        os.replace(tmp_path, path)
+        fsync_directory(directory)
+    return tmp_path
+
+
+class FileLock:
+    """Reentrant exclusive lock shared by the threads of a process and by other processes.
+
+    Threads are serialized by an RLock; processes by flock() on `path`,
+    which is opened on first use so a forked child gets its own lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._depth = 0
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0 and fcntl:
+                if self._pid != os.getpid():
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+class Journal:
+    """Append-only NDJSON log of store operations, kept next to the snapshot.
+
+    The first line is a header naming the snapshot the log applies to
+    (its mtime/size/inode signature). A log whose base does not match the
+    snapshot on disk is stale - the snapshot was rewritten after it - and
+    is discarded on recovery.
+
+    append() writes the line straight to the file and returns a ticket;
+    sync(ticket) waits until that line is fsynced. Concurrent writers share
+    fsyncs (group commit): whichever thread finds no fsync in flight syncs
+    everything written so far on behalf of the others.
+
+    Several processes may share one log. `size` is how far this process
+    has read or written it; catch_up() returns what other processes
+    appended past that point. Callers serialize appends, and anything that
+    rewrites or truncates the log, with a FileLock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.entries = 0
+        self._fd = None
+        self._base = None
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._cond = threading.Condition()
+
+    def _header(self, base):
+        return (json.dumps({"op": "base", "snapshot": list(base) if base else None}) + '\n').encode()
+
+    def _read_ops(self, path, base):
+        """Return (ops, valid_bytes) for a log file, or None if it is stale or unreadable"""
+        try:
+            with open(path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            return None
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return None
+        snapshot = header.get("snapshot")
+        if (tuple(snapshot) if snapshot else None) != base:
+            return None
+        ops, valid = [], len(lines[0]) + 1
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                # Torn write from a crash: keep everything before it
+                break
+            valid += len(line) + 1
+        return ops, valid
+
+    def recover(self, base):
+        """Return the operations to replay on top of the snapshot with signature `base`"""
+        self.close()
+        self._base = base
+        # A compaction that crashed between its two renames leaves the new
+        # log in .tmp; adopt it only if the new snapshot made it into place.
+        tmp_path = self.path + '.tmp'
+        if os.path.exists(tmp_path):
+            if self._read_ops(tmp_path, base) is not None:
+                os.replace(tmp_path, self.path)
+            else:
+                os.remove(tmp_path)
+        result = self._read_ops(self.path, base)
+        if result is None:
+            if os.path.exists(self.path):
+                print(f"Discarding stale journal {self.path}")
+                os.remove(self.path)
+            # The log file is created lazily by the first append()
+            self.size = self.entries = 0
+            return []
+        ops, valid = result
+        self._open()
+        if valid < self.size:
+            os.ftruncate(self._fd, valid)
+            self.size = valid
+        self.entries = len(ops)
+        return ops
+
+    def catch_up(self):
+        """Operations appended by other processes since `size`, or None if the log was replaced.
+
+        Only complete lines are consumed; a line still being written is
+        picked up by a later call.
+        """
+        if self._fd is None:
+            if not os.path.exists(self.path):
+                return []
+            # Created by another process's first append
+            self._open()
+            self.size = 0
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            return None
+        data = self._read(self.size)
+        offset = self.size
+        if offset == 0:
+            header, newline, data = data.partition(b'\n')
+            if not newline:
+                return []
+            try:
+                snapshot = json.loads(header).get("snapshot")
+            except ValueError:
+                return None
+            if (tuple(snapshot) if snapshot else None) != self._base:
+                return None
+            offset = len(header) + 1
+        end = data.rfind(b'\n') + 1
+        try:
+            ops = [json.loads(line) for line in data[:end].split(b'\n') if line]
+        except ValueError:
+            return None
+        self.size = offset + end
+        self.entries += len(ops)
+        return ops
+
+    def _read(self, offset):
+        # Appends use O_APPEND, so moving the shared file offset is harmless
+        os.lseek(self._fd, offset, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 1024 * 1024)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def reset(self, base, tail=b''):
+        """Atomically replace the log with a header for `base` followed by `tail`"""
+        self.prepare(base, tail)
+        self.swap()
+
+    def prepare(self, base, tail=b''):
+        """Write the replacement log to a temp file without installing it"""
+        self._base = base
+        write_atomic(self.path, self._header(base) + tail, rename=False)
+
+    def swap(self):
+        """Install the log written by prepare()"""
+        self.close()
+        os.replace(self.path + '.tmp', self.path)
+        fsync_directory(os.path.dirname(self.path))
+        self._open()
+        self.entries = self.tail(0).count(b'\n')
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self._fd).st_size
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            with self._cond:
+                self._synced = self._written
+                self._cond.notify_all()
+
+    def tail(self, offset):
+        """Raw operation lines from byte `offset` up to `size`"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(max(self.size - offset, 0))
+        except FileNotFoundError:
+            return b''
+        if offset == 0:
+            data = data.partition(b'\n')[2]
+        return data
+
+    def append(self, op):
+        """Write one operation to the log and return a ticket for sync()"""
+        return self.append_many([op])
+
+    def append_many(self, ops):
+        """Write several operations with a single write() and return one ticket"""
+        data = ''.join(json.dumps(op) + '\n' for op in ops).encode()
+        if self._fd is None:
+            self.reset(self._base)
+        elif os.fstat(self._fd).st_size > self.size:
+            # Torn line left by a process that crashed mid-append
+            os.ftruncate(self._fd, self.size)
+        os.write(self._fd, data)
+        self.size += len(data)
+        self.entries += len(ops)
+        with self._cond:
+            self._written += 1
+            return self._written
+
+    def sync(self, ticket):
+        """Block until the operation behind `ticket` is on stable storage"""
+        with self._cond:
+            while self._synced < ticket:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                fd = self._fd
+                self._cond.release()
+                synced = False
+                try:
+                    os.fsync(fd)
+                    synced = True
+                except (OSError, TypeError):
+                    # close() fsyncs before swapping the file out from under us
+                    if fd == self._fd:
+                        raise
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    if synced:
+                        self._synced = max(self._synced, target)
+                    self._cond.notify_all()
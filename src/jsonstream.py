@@ -0,0 +1,98 @@
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+MAX_ITEM_SIZE = 16 * 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+
+def iter_ndjson(stream, invalid=None):
+    """Yield one JSON value per non-blank line of a text or binary stream.
+
+    A line that is not valid JSON raises ValueError, unless `invalid` is
+    given: then it is called with the line, which is skipped.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            if invalid is None:
+                raise
+            invalid(line)
+            continue
+        yield value
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Yield the items of a top-level JSON array without reading it all at once.
+
+    Only the current chunk and the item being decoded are held in memory.
+    Raises ValueError if the stream is not a well-formed JSON array.
+    """
+    buffer = ''
+    position = 0
+    eof = False
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk, final=eof)
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[position:position + 1] != '[':
+        raise ValueError("Expected a JSON array")
+    position += 1
+    expect_item = True
+    first = True
+    while True:
+        skip_whitespace()
+        if position >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        char = buffer[position]
+        if char == ']' and (first or not expect_item):
+            return
+        if not expect_item:
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            position += 1
+            expect_item = True
+            continue
+        while True:
+            try:
+                item, end = _decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof or len(buffer) - position > MAX_ITEM_SIZE:
+                    raise
+                fill()
+                skip_whitespace()
+                continue
+            if (not eof and isinstance(item, (int, float))
+                    and not buffer[end:].strip('0123456789.eE+-')):
+                # A number cut off at the chunk boundary may continue in the next one
+                fill()
+                continue
+            break
+        position = end
+        yield item
+        expect_item = False
+        first = False
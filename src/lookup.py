@@ -0,0 +1,191 @@
+import ipaddress
+import re
+from array import array
+from urllib.parse import urlsplit
+
+# Canonical hostnames eligible for suffix matching (at least two labels)
+_HOSTNAME = re.compile(r'[a-z0-9_-]+(?:\.[a-z0-9_-]+)+')
+
+
+def _add_id(ids, key, value):
+    """Record value under key; returns True if key is new.
+
+    Nearly every key maps to one value, so a lone value is stored as is
+    and only a second one turns it into a list. Lists are replaced rather
+    than changed in place, so a shallow copy of `ids` stays as it was.
+    """
+    existing = ids.get(key)
+    if existing is None:
+        ids[key] = value
+        return True
+    if isinstance(existing, list):
+        ids[key] = existing + [value]
+    else:
+        ids[key] = [existing, value]
+    return False
+
+
+def _remove_id(ids, key, value):
+    """Forget value under key; returns True if key is now gone"""
+    existing = ids.get(key)
+    if existing is None:
+        return False
+    if isinstance(existing, list):
+        existing = list(existing)
+        existing.remove(value)
+        ids[key] = existing[0] if len(existing) == 1 else existing
+        return False
+    if existing != value:
+        raise ValueError(f"{value!r} is not indexed under {key!r}")
+    del ids[key]
+    return True
+
+
+def _id_list(found):
+    return list(found) if isinstance(found, list) else [found]
+
+
+def network_key(key):
+    """ip_network for a canonical IP/CIDR indicator, reversed labels for a hostname, else None"""
+    if not isinstance(key, str) or not key or '://' in key:
+        return None
+    if ':' in key or key[0].isdigit():
+        try:
+            return ipaddress.ip_network(key, strict=False)
+        except ValueError:
+            pass
+    if _HOSTNAME.fullmatch(key):
+        return tuple(reversed(key.split('.')))
+    return None
+
+
+def observable_key(key):
+    """network_key() of a canonical observable; URLs are matched by their host"""
+    if isinstance(key, str) and '://' in key:
+        try:
+            host = urlsplit(key).hostname
+        except ValueError:
+            return None
+        return network_key(host)
+    return network_key(key)
+
+
+def covering_keys(target):
+    """Every canonical indicator that would cover an observable's network_key()"""
+    if isinstance(target, tuple):
+        return ['.'.join(reversed(target[:n])) for n in range(2, len(target) + 1)]
+    keys = []
+    if target.prefixlen == target.max_prefixlen:
+        keys.append(str(target.network_address))
+    for length in range(target.prefixlen + 1):
+        keys.append(str(target.supernet(new_prefix=length)))
+    return keys
+
+
+class NetworkIndex:
+    """Covering-match index for IP ranges and domain suffixes.
+
+    Addresses and CIDR blocks are held per address family in one hash
+    table per prefix length, keyed by the masked network address; an
+    observable is masked to each prefix length in use and probed, so a
+    match costs at most 33 (IPv4) or 129 (IPv6) probes no matter how many
+    networks are stored. An observable's parent domains (evil.com,
+    cdn.evil.com, ...) are probed in turn, one probe per label. Other
+    indicators (URLs, hashes) are not held here.
+
+    `keys` is the store's canonical indicator -> threat id mapping (a
+    KeyIndex), kept current by the store before views are told of a
+    change. Hostnames are probed in it directly, so the index holds none
+    of its own, and the tables hold threat ids whose indicators are read
+    back through it.
+    """
+
+    fields = ('indicator',)
+
+    def __init__(self, keys):
+        self._keys = keys
+        self.reset()
+
+    def reset(self):
+        self._networks = {4: {}, 6: {}}
+
+    def rebuild(self, items):
+        self.reset()
+        for threat_id, threat in items:
+            self.add(threat_id, threat)
+
+    def _table(self, indicator):
+        target = network_key(indicator)
+        if target is None or isinstance(target, tuple):
+            return None, None, None
+        return self._networks[target.version], target.prefixlen, int(target.network_address)
+
+    def add(self, threat_id, threat):
+        tables, prefixlen, address = self._table(threat.get('indicator'))
+        if tables is not None:
+            _add_id(tables.setdefault(prefixlen, {}), address, threat_id)
+
+    def remove(self, threat_id, threat):
+        tables, prefixlen, address = self._table(threat.get('indicator'))
+        if tables is None or prefixlen not in tables:
+            return
+        table = tables[prefixlen]
+        if _remove_id(table, address, threat_id) and not table:
+            del tables[prefixlen]
+
+    def __len__(self):
+        return sum(len(table) for tables in self._networks.values() for table in tables.values())
+
+    def dump(self):
+        """Copy the index for a binary snapshot; returns a function giving its sections.
+
+        Parsing indicators is what makes rebuilding slow, so the hash
+        tables are saved as they are.
+        """
+        networks = [(version, prefixlen, dict(table))
+                    for version, tables in self._networks.items() for prefixlen, table in tables.items()]
+
+        def sections():
+            # One (address, threat id) entry per threat held in each table
+            tables, addresses, rows = [], [], array('I')
+            for version, prefixlen, table in networks:
+                start = len(rows)
+                for address, slot in table.items():
+                    for threat_id in _id_list(slot):
+                        addresses.append(address)
+                        rows.append(threat_id)
+                tables.append([version, prefixlen, len(rows) - start])
+            return {'tables': tables, 'addresses': addresses, 'rows': rows}
+        return sections
+
+    def restore(self, sections, records):
+        """Load what dump() saved; returns True"""
+        self.reset()
+        addresses, rows, start = sections['addresses'], sections['rows'], 0
+        for version, prefixlen, count in sections['tables']:
+            table = self._networks[version][prefixlen] = {}
+            for address, row in zip(addresses[start:start + count], rows[start:start + count]):
+                if table.setdefault(address, row) != row:
+                    _add_id(table, address, row)
+            start += count
+        return True
+
+    def match(self, target):
+        """(indicator, threat ids) for every stored indicator covering an observable_key()"""
+        keys = self._keys
+        if isinstance(target, tuple):
+            found = []
+            for key in covering_keys(target):
+                threat_id = keys.get(key)
+                if threat_id is not None:
+                    found.append((key, [threat_id]))
+            return found
+        found = []
+        address = int(target.network_address)
+        bits = target.max_prefixlen
+        for length, table in self._networks[target.version].items():
+            if length <= target.prefixlen:
+                slot = table.get(address >> (bits - length) << (bits - length))
+                if slot is not None:
+                    found.extend(_id_list(slot))
+        return [(keys.text(threat_id), [threat_id]) for threat_id in found]
@@ -0,0 +1,184 @@
+"""Prometheus metrics, served as text by /metrics.
+
+Counters, gauges and histograms are kept in plain dicts keyed by label
+values, so recording a sample costs a lock, a bisect and a few additions;
+all formatting happens when /metrics is scraped. Metrics are per process:
+under `serve --workers N` each worker counts the requests it handled.
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Request latencies, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Store operations, from an fsync to a cold load of millions of threats
+OPERATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Response body sizes, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Metric:
+    """Base class: a named family of samples, one per combination of label values.
+
+    Pass `collect` to compute the samples at scrape time instead: a
+    function returning a number, or {label values tuple: number}.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """(suffix, label values, extra label, value) tuples for the exposition format"""
+        if self.collect is None:
+            with self._lock:
+                values = dict(self._values)
+        else:
+            values = self.collect()
+            if values is None:
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [('', key, '', value) for key, value in sorted(values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labels, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the `with` block takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        samples = []
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                samples.append(('_bucket', key, f'le="{_format_value(float(bound))}"', cumulative))
+            samples.append(('_sum', key, '', state[-2]))
+            samples.append(('_count', key, '', state[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        families = []
+        for metric in self._metrics:
+            try:
+                families.append(metric.render())
+            except Exception as e:
+                # A failing collector must not take /metrics down with it
+                print(f"Error collecting metric {metric.name}: {e}")
+        return '\n'.join(families) + '\n'
+
+
+REGISTRY = Registry()
+
+STORE_SECONDS = REGISTRY.register(Histogram(
+    'threats_store_operation_seconds', 'Time spent in store operations (parse, build, append, sync, ...)',
+    ('operation',), OPERATION_BUCKETS))
+STORE_ERRORS = REGISTRY.register(Counter(
+    'threats_store_errors_total', 'Failed store operations', ('operation',)))
+
+
+def resident_memory():
+    """Resident set size of this process in bytes (Linux only, else None)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+_STARTED = time.time()
+
+REGISTRY.register(Gauge('process_resident_memory_bytes', 'Resident memory size in bytes',
+                        collect=resident_memory))
+REGISTRY.register(Gauge('process_start_time_seconds', 'Start time of the process since the epoch',
+                        collect=lambda: _STARTED))
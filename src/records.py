@@ -0,0 +1,530 @@
+import json
+from array import array
+from collections.abc import MutableMapping
+
+from .snapshot import pack_records, unpack_records
+
+# Below this much dead space the text heap is not worth repacking
+REPACK_MIN_BYTES = 1024 * 1024
+
+# Columns grow by at least this many rows at a time
+GROW_MIN_ROWS = 1024
+
+# KeyIndex slots that hold no row: never used, or used by a row since removed
+EMPTY_SLOT, REMOVED_SLOT = 0xFFFFFFFF, 0xFFFFFFFE
+
+
+class Interner:
+    """Distinct values <-> small integer codes; code 0 is reserved"""
+
+    def __init__(self):
+        self.values = [None]
+        self.lookup = {}
+
+    def code(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values) - 1
+
+
+class DictionaryColumn:
+    """Strings stored as codes into an Interner shared by all such columns"""
+
+    parts = ('codes',)
+
+    def __init__(self, strings, codes=None):
+        self.strings = strings
+        # 16-bit codes until the strings outgrow them; _store() widens the array
+        self.codes = codes if codes is not None else array('H')
+
+    def grow(self, count):
+        self.codes.frombytes(bytes(count * self.codes.itemsize))
+
+    def _store(self, row, code):
+        try:
+            self.codes[row] = code
+        except OverflowError:
+            self.codes = array('I', self.codes)
+            self.codes[row] = code
+
+    def set(self, row, value):
+        if type(value) is not str:
+            return False
+        code = self.strings.lookup.get(value)
+        self._store(row, code if code is not None else self.strings.code(value))
+        return True
+
+    def get(self, row):
+        return self.strings.values[self.codes[row]]
+
+    def getter(self):
+        """get() with the lookups bound, for materializing rows in bulk"""
+        # The codes array is looked up per call, as _store() may replace it
+        values = self.strings.values
+        return lambda row: values[self.codes[row]]
+
+    def clear(self, row):
+        self.codes[row] = 0
+
+    def copy(self):
+        return type(self)(self.strings, array(self.codes.typecode, self.codes))
+
+
+class ListColumn(DictionaryColumn):
+    """Lists of strings (e.g. sources), interned as tuples"""
+
+    def set(self, row, value):
+        if type(value) is not list:
+            return False
+        value = tuple(value)
+        for item in value:
+            if type(item) is not str:
+                return False
+        self._store(row, self.strings.code(value))
+        return True
+
+    def get(self, row):
+        return list(self.strings.values[self.codes[row]])
+
+    def getter(self):
+        values = self.strings.values
+        return lambda row: list(values[self.codes[row]])
+
+
+class NumberColumn:
+    """Ints and floats in a double array; a kind byte restores ints as ints"""
+
+    INT, FLOAT = 1, 2
+    parts = ('values', 'kinds')
+
+    def __init__(self, values=None, kinds=None):
+        self.values = values if values is not None else array('d')
+        self.kinds = kinds if kinds is not None else array('b')
+
+    def grow(self, count):
+        self.values.frombytes(bytes(count * self.values.itemsize))
+        self.kinds.frombytes(bytes(count))
+
+    def set(self, row, value):
+        kind = type(value)
+        if kind is int and -2 ** 53 <= value <= 2 ** 53:
+            self.kinds[row] = self.INT
+        elif kind is float:
+            self.kinds[row] = self.FLOAT
+        else:
+            return False
+        self.values[row] = value
+        return True
+
+    def get(self, row):
+        value = self.values[row]
+        return int(value) if self.kinds[row] == self.INT else value
+
+    def getter(self):
+        values, kinds, INT = self.values, self.kinds, self.INT
+
+        def get(row):
+            value = values[row]
+            return int(value) if kinds[row] == INT else value
+        return get
+
+    def clear(self, row):
+        self.kinds[row] = 0
+
+    def copy(self):
+        return NumberColumn(array('d', self.values), array('b', self.kinds))
+
+
+class TextHeap:
+    """Append-only UTF-8 buffer that TextColumns slice strings out of.
+
+    A value equal to the one appended just before it is not appended
+    again, so a threat whose first_seen, last_seen and timestamp are the
+    same stores the text once.
+    """
+
+    def __init__(self, data=None):
+        self.data = data if data is not None else bytearray()
+        self.garbage = 0
+        self.last = (None, 0)
+
+    def append(self, data):
+        """Offset of `data` in the buffer"""
+        last, start = self.last
+        if data != last:
+            start = len(self.data)
+            self.data += data
+            self.last = (data, start)
+        return start
+
+    def maybe_repack(self, columns):
+        """Drop the garbage once it is over half the buffer, moving the live strings of `columns`"""
+        if self.garbage < REPACK_MIN_BYTES or self.garbage * 2 < len(self.data):
+            return
+        old, data = self.data, bytearray()
+        columns = list(columns)
+        for row in range(len(columns[0].starts) if columns else 0):
+            moved = {}
+            for column in columns:
+                length = column.lengths[row]
+                if length:
+                    start = column.starts[row]
+                    if start not in moved:
+                        moved[start] = len(data)
+                        data += old[start:start + length]
+                    column.starts[row] = moved[start]
+        # A new buffer, so copies still slicing the old one stay valid
+        self.data = data
+        self.garbage = 0
+        self.last = (None, 0)
+
+
+class TextColumn:
+    """Mostly-unique short strings (indicators, timestamps) packed into a TextHeap.
+
+    A str object costs ~50 bytes of overhead; here a value costs its UTF-8
+    bytes plus 6 bytes of offset and length. Offsets are 32-bit and lengths
+    16-bit, so a heap holds at most 4GB and a value at most 64KB; set()
+    refuses a value that would not fit.
+    Overwritten values become garbage in the heap until RecordTable
+    repacks it.
+    """
+
+    parts = ('starts', 'lengths')
+
+    def __init__(self, heap, starts=None, lengths=None):
+        self.heap = heap
+        self.starts = starts if starts is not None else array('I')
+        self.lengths = lengths if lengths is not None else array('H')
+
+    def grow(self, count):
+        self.starts.frombytes(bytes(count * self.starts.itemsize))
+        self.lengths.frombytes(bytes(count * self.lengths.itemsize))
+
+    def set(self, row, value):
+        if type(value) is not str:
+            return False
+        data = value.encode('utf-8', 'surrogatepass')
+        if len(data) > 0xFFFF or len(self.heap.data) + len(data) > 0xFFFFFFFF:
+            return False
+        self.heap.garbage += self.lengths[row]
+        self.starts[row] = self.heap.append(data)
+        self.lengths[row] = len(data)
+        return True
+
+    def get(self, row):
+        start = self.starts[row]
+        return self.heap.data[start:start + self.lengths[row]].decode('utf-8', 'surrogatepass')
+
+    def getter(self):
+        heap, starts, lengths = self.heap, self.starts, self.lengths
+
+        def get(row):
+            start = starts[row]
+            return heap.data[start:start + lengths[row]].decode('utf-8', 'surrogatepass')
+        return get
+
+    def clear(self, row):
+        self.heap.garbage += self.lengths[row]
+        self.lengths[row] = 0
+
+    def copy(self, heap):
+        return TextColumn(heap, array('I', self.starts), array('H', self.lengths))
+
+
+class RecordTable(MutableMapping):
+    """Mapping of threat id -> threat dict, stored column by column.
+
+    Rows are indexed by the store's dense integer ids. Known fields live in
+    typed columns: the repeated strings (type, source, severity,
+    description, sources) as codes into a shared table of distinct values,
+    confidence in a double array and timestamps packed into one byte
+    buffer. A row also records its tuple of keys (interned, so the key
+    order of every record is preserved) and keeps anything that does not
+    fit a column in a small per-row dict.
+
+    Dicts are only materialized when a record is read, e.g. to serialize
+    a page of /api/data, and are not kept.
+    """
+
+    def __init__(self):
+        self._layouts = array('I')
+        self._layout_table = Interner()
+        self._strings = Interner()
+        self._lists = Interner()
+        self._heap = TextHeap()
+        self._columns = {
+            'indicator': TextColumn(self._heap),
+            'type': DictionaryColumn(self._strings),
+            'source': DictionaryColumn(self._strings),
+            'severity': DictionaryColumn(self._strings),
+            'description': DictionaryColumn(self._strings),
+            'sources': ListColumn(self._lists),
+            'confidence': NumberColumn(),
+            'first_seen': TextColumn(self._heap),
+            'last_seen': TextColumn(self._heap),
+            'timestamp': TextColumn(self._heap),
+        }
+        self._extras = {}
+        self._getters = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, row):
+        return type(row) is int and 0 <= row < len(self._layouts) and self._layouts[row] != 0
+
+    def __iter__(self):
+        layouts = self._layouts
+        return (row for row in range(len(layouts)) if layouts[row])
+
+    def __getitem__(self, row):
+        if row not in self:
+            raise KeyError(row)
+        return self._materialize(row)
+
+    def _materialize(self, row, fields=None):
+        layout = self._layouts[row]
+        getters = self._getters.get((layout, fields))
+        if getters is None:
+            getters = self._getters[(layout, fields)] = [
+                (field, self._columns[field].getter() if field in self._columns else None)
+                for field in self._layout_table.values[layout]
+                if fields is None or field in fields
+            ]
+        extras = self._extras.get(row)
+        if extras is None:
+            return {field: get(row) for field, get in getters}
+        return {field: extras[field] if field in extras else get(row) for field, get in getters}
+
+    def _grow(self, size):
+        # Grown in blocks: rows past the last one stay empty (layout 0)
+        count = max(size - len(self._layouts), len(self._layouts) // 8, GROW_MIN_ROWS)
+        self._layouts.frombytes(bytes(count * self._layouts.itemsize))
+        for column in self._columns.values():
+            column.grow(count)
+
+    def __setitem__(self, row, record):
+        layouts = self._layouts
+        if row >= len(layouts):
+            self._grow(row + 1)
+        replaced = layouts[row] != 0
+        if replaced:
+            self._release(row)
+        else:
+            self._count += 1
+        columns = self._columns
+        extras = None
+        for field, value in record.items():
+            column = columns.get(field)
+            if column is None or not column.set(row, value):
+                if extras is None:
+                    extras = {}
+                extras[field] = value
+        if extras is not None:
+            self._extras[row] = extras
+        layouts[row] = self._layout_table.code(tuple(record))
+        if replaced:
+            self._repack()
+
+    def __delitem__(self, row):
+        if row not in self:
+            raise KeyError(row)
+        self._release(row)
+        self._layouts[row] = 0
+        self._count -= 1
+        self._repack()
+
+    def _repack(self):
+        self._heap.maybe_repack(column for column in self._columns.values() if isinstance(column, TextColumn))
+
+    def _release(self, row):
+        for column in self._columns.values():
+            column.clear(row)
+        self._extras.pop(row, None)
+
+    def items(self, fields=None):
+        """(row, record) pairs; given a tuple of `fields`, records only hold those"""
+        layouts, materialize = self._layouts, self._materialize
+        for row in range(len(layouts)):
+            if layouts[row]:
+                yield row, materialize(row, fields)
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+    def text(self, field, row):
+        """A TextColumn field of a row straight from the column, for rows known to keep it there"""
+        return self._columns[field].get(row)
+
+    def copy(self):
+        """Independent table with the same rows, for reading while this one changes.
+
+        Interned values are shared (they are only ever appended to) and so
+        is the text buffer: writes append to it, and repacking replaces it.
+        """
+        table = RecordTable.__new__(RecordTable)
+        table._layouts = array('I', self._layouts)
+        table._layout_table = self._layout_table
+        table._strings = self._strings
+        table._lists = self._lists
+        table._heap = TextHeap(self._heap.data)
+        table._columns = {
+            field: column.copy(table._heap) if isinstance(column, TextColumn) else column.copy()
+            for field, column in self._columns.items()
+        }
+        table._extras = dict(self._extras)
+        table._getters = {}
+        table._count = self._count
+        return table
+
+    def dump(self):
+        """Sections for a binary snapshot (see snapshot.py); call it on a copy()"""
+        sections = {
+            'layouts': self._layouts,
+            'layout_table': self._layout_table.values[1:],
+            'strings': self._strings.values[1:],
+            'lists': self._lists.values[1:],
+            'heap': bytes(self._heap.data),
+            'extras': pack_records((row, json.dumps(extras).encode()) for row, extras in self._extras.items()),
+        }
+        for field, column in self._columns.items():
+            for part in column.parts:
+                sections[f'{field}.{part}'] = getattr(column, part)
+        return sections
+
+    @classmethod
+    def restore(cls, sections):
+        """Table from the sections written by dump(); rows are decoded when read"""
+        table = cls()
+        table._layouts = layouts = sections['layouts']
+        for interner, values in ((table._layout_table, sections['layout_table']),
+                                 (table._strings, sections['strings']),
+                                 (table._lists, sections['lists'])):
+            for value in values:
+                interner.code(tuple(value) if isinstance(value, list) else value)
+        table._heap.data = sections['heap']
+        for field, column in table._columns.items():
+            for part in column.parts:
+                values = sections[f'{field}.{part}']
+                if len(values) != len(layouts):
+                    raise ValueError(f"Column {field} holds {len(values)} rows, expected {len(layouts)}")
+                setattr(column, part, values)
+        table._extras = {row: json.loads(data) for row, data in unpack_records(sections['extras'])}
+        table._count = len(layouts) - layouts.count(0)
+        return table
+
+
+class KeyIndex:
+    """Mapping of str -> row for strings a RecordTable holds (the store's canonical indicators).
+
+    A dict costs a str object (~50 bytes of overhead plus the text), an
+    entry and an int object per row. This open-addressing table holds
+    only the row and 32 bits of the string's hash per slot, and compares
+    keys against `text(row)`, which reads them back from the table.
+    Slots are kept at most two thirds full; a removed row leaves its slot
+    marked removed until the next resize.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.clear()
+
+    def clear(self, capacity=8):
+        self._rows = array('I', [EMPTY_SLOT]) * capacity
+        self._hashes = array('I', [0]) * capacity
+        self._count = 0
+        self._used = 0
+
+    def _find(self, key):
+        """(hash, slot, found): the slot holding key, else the one it would go in"""
+        if type(key) is not str:
+            return 0, -1, False
+        rows, hashes, text = self._rows, self._hashes, self.text
+        mask = len(rows) - 1
+        h = hash(key) & 0xFFFFFFFF
+        slot, free = h & mask, -1
+        while True:
+            row = rows[slot]
+            if row == EMPTY_SLOT:
+                return h, slot if free < 0 else free, False
+            if row == REMOVED_SLOT:
+                if free < 0:
+                    free = slot
+            elif hashes[slot] == h and text(row) == key:
+                return h, slot, True
+            slot = (slot + 1) & mask
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._find(key)[2]
+
+    def get(self, key, default=None):
+        _, slot, found = self._find(key)
+        return self._rows[slot] if found else default
+
+    def __getitem__(self, key):
+        _, slot, found = self._find(key)
+        if not found:
+            raise KeyError(key)
+        return self._rows[slot]
+
+    def __setitem__(self, key, row):
+        h, slot, found = self._find(key)
+        if slot < 0:
+            raise TypeError(f"KeyIndex keys are str, not {type(key).__name__}")
+        if not found:
+            self._count += 1
+            if self._rows[slot] == EMPTY_SLOT:
+                self._used += 1
+        self._rows[slot] = row
+        self._hashes[slot] = h
+        if self._used * 3 > len(self._rows) * 2:
+            self._resize(self._count)
+
+    def pop(self, key, default=None):
+        _, slot, found = self._find(key)
+        if not found:
+            return default
+        row = self._rows[slot]
+        self._rows[slot] = REMOVED_SLOT
+        self._count -= 1
+        return row
+
+    def values(self):
+        """The rows held, in no particular order"""
+        return (row for row in self._rows if row < REMOVED_SLOT)
+
+    def rebuild(self, rows):
+        """Hold `rows`, whose keys are text(row) and distinct"""
+        rows = list(rows)
+        self.clear()
+        self._resize(len(rows))
+        text = self.text
+        for row in rows:
+            self[text(row)] = row
+
+    def _resize(self, count):
+        """Rehash the live rows into a table at most half full at `count` rows"""
+        old_rows, old_hashes = self._rows, self._hashes
+        capacity = max(8, 1 << (count * 2).bit_length())
+        rows = self._rows = array('I', [EMPTY_SLOT]) * capacity
+        hashes = self._hashes = array('I', [0]) * capacity
+        mask = capacity - 1
+        for row, h in zip(old_rows, old_hashes):
+            if row < REMOVED_SLOT:
+                slot = h & mask
+                while rows[slot] != EMPTY_SLOT:
+                    slot = (slot + 1) & mask
+                rows[slot] = row
+                hashes[slot] = h
+        self._used = self._count
@@ -0,0 +1,49 @@
+"""Production serving: python -m src.app serve --workers N
+
+Runs the app under gunicorn, a pre-fork WSGI server, so reads scale across
+cores. Every worker process keeps its own in-memory ThreatStore; they
+share the snapshot and journal on disk, which ThreatStore locks and
+replays across processes. gunicorn is an optional dependency (Unix only);
+the development server does not need it.
+
+Workers use gthread, where a Server-Sent Events client holds a thread for
+as long as it listens. Each worker therefore accepts only stream_limit()
+streams; further clients are turned away and fall back to polling.
+"""
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # optional: only `serve` needs it
+    BaseApplication = None
+
+# Threads per worker; /api/stream holds one for as long as a client listens
+DEFAULT_THREADS = 16
+# Threads per worker that /api/stream connections may not take, so other
+# requests never queue behind them
+RESERVED_THREADS = 4
+
+
+def stream_limit(threads):
+    """How many /api/stream connections a worker with `threads` threads accepts"""
+    return max(0, threads - RESERVED_THREADS)
+
+
+def serve(app, host='0.0.0.0', port=8080, workers=1, threads=DEFAULT_THREADS, on_worker_start=None):
+    """Run `app` under gunicorn until interrupted; returns an exit status"""
+    if BaseApplication is None:
+        print("The serve command needs gunicorn: pip install gunicorn")
+        return 1
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', max(1, workers))
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', max(1, threads))
+            if on_worker_start:
+                self.cfg.set('post_worker_init', lambda worker: on_worker_start())
+
+        def load(self):
+            return app
+
+    Server().run()
+    return 0
@@ -0,0 +1,239 @@
+"""Binary snapshots of the threat store, for a fast cold start.
+
+    python -m src.snapshot [threats.json] [threats.json.bin]
+    python -m src.snapshot --to-json [threats.json.bin] [threats.json]
+
+Loading threats.json means parsing every record and rebuilding every
+index from it. A binary snapshot holds the store's RecordTable columns and
+the views' prebuilt indexes as raw arrays instead, so loading one is a
+handful of bulk copies out of a memory-mapped file plus rebuilding the
+hash tables keyed by indicator; records are only decoded into dicts when
+they are read.
+
+The JSON snapshot stays the source of truth. A binary snapshot records
+the signature of the JSON snapshot it was built from (and how much of
+the journal it covers), and the store ignores one that no longer matches
+and loads the JSON file instead. --to-json writes through the store
+(see ThreatStore.overwrite()), so it will not rewrite a JSON snapshot
+whose journal holds writes the binary snapshot may lack.
+
+Layout, integers little-endian:
+
+    magic        8 bytes
+    header size  8 bytes
+    header       JSON: format version, source signature, journal position,
+                 {section name: [kind, offset, length]}
+    sections     each 8-byte aligned: a typed array (kind is the array
+                 typecode), raw bytes, JSON, or length-prefixed records
+                 packed by pack_records()
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from .journal import write_atomic
+
+MAGIC = b'THRSNAP\x00'
+FORMAT_VERSION = 5
+
+# Binary snapshots live next to the JSON snapshot they were built from
+BINARY_SUFFIX = '.bin'
+
+_PREFIX = struct.Struct('<8sQ')
+_RECORD = struct.Struct('<II')
+_ALIGN = 8
+
+
+def pack_records(records):
+    """Pack (key, bytes) pairs as length-prefixed records: key and length as uint32, then the bytes"""
+    chunks = []
+    for key, data in records:
+        chunks.append(_RECORD.pack(key, len(data)))
+        chunks.append(data)
+    return b''.join(chunks)
+
+
+def unpack_records(data):
+    """Yield the (key, bytes) pairs of pack_records()"""
+    offset, end = 0, len(data)
+    while offset < end:
+        key, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        yield key, data[offset:offset + length]
+        offset += length
+
+
+def _encode(value):
+    """(kind, bytes-like) for a section value"""
+    if isinstance(value, array):
+        if sys.byteorder != 'little':
+            value = array(value.typecode, value)
+            value.byteswap()
+        return value.typecode, value
+    if isinstance(value, (bytes, bytearray)):
+        return 'bytes', value
+    return 'json', json.dumps(value, separators=(',', ':')).encode()
+
+
+def write_snapshot(path, header, sections):
+    """Atomically write a binary snapshot.
+
+    `sections` maps a prefix to {name: value}, where a value is an array,
+    bytes, or anything JSON can encode; they are stored as 'prefix.name'.
+    """
+    encoded, table, offset = [], {}, 0
+    for prefix, values in sections.items():
+        for name, value in values.items():
+            kind, data = _encode(value)
+            length = memoryview(data).nbytes
+            table[f'{prefix}.{name}'] = [kind, offset, length]
+            encoded.append((data, -length % _ALIGN))
+            offset += length + -length % _ALIGN
+    header = dict(header, version=FORMAT_VERSION, sections=table)
+    raw = json.dumps(header, separators=(',', ':')).encode()
+    raw += b' ' * (-(len(raw) + _PREFIX.size) % _ALIGN)
+
+    def chunks():
+        yield _PREFIX.pack(MAGIC, len(raw))
+        yield raw
+        for data, padding in encoded:
+            yield data
+            yield bytes(padding)
+
+    # Unique per writer: a compaction and a replace() may both be writing
+    suffix = f'.{os.getpid()}-{threading.get_ident()}.tmp'
+    write_atomic(path, chunks(), suffix=suffix)
+
+
+class Snapshot:
+    """A binary snapshot, memory-mapped; sections are decoded when asked for.
+
+    Raises FileNotFoundError if there is no file and ValueError if it is
+    not a binary snapshot in this format.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is empty")
+        try:
+            if len(self._map) < _PREFIX.size:
+                raise ValueError(f"{path} is not a binary snapshot")
+            magic, size = _PREFIX.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a binary snapshot")
+            self.header = json.loads(self._map[_PREFIX.size:_PREFIX.size + size])
+            if self.header.get('version') != FORMAT_VERSION:
+                raise ValueError(f"{path} has unsupported format version {self.header.get('version')}")
+            self._start = _PREFIX.size + size
+            self._sections = self.header['sections']
+        except BaseException:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def get(self, name):
+        """Decode a section: an array, a bytearray or a JSON value"""
+        kind, offset, length = self._sections[name]
+        start = self._start + offset
+        if start + length > len(self._map):
+            raise ValueError(f"{self.path} is truncated")
+        if kind == 'json':
+            return json.loads(self._map[start:start + length])
+        with memoryview(self._map)[start:start + length] as data:
+            if kind == 'bytes':
+                return bytearray(data)
+            values = array(kind)
+            if length % values.itemsize:
+                raise ValueError(f"{self.path}: section {name} does not hold whole items")
+            values.frombytes(data)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def sections(self, prefix):
+        """{name: value} access to the sections stored under `prefix`"""
+        return SnapshotSections(self, prefix)
+
+
+class SnapshotSections:
+    def __init__(self, snapshot, prefix):
+        self._snapshot = snapshot
+        self._prefix = prefix + '.'
+
+    def __contains__(self, name):
+        return self._prefix + name in self._snapshot
+
+    def __getitem__(self, name):
+        return self._snapshot.get(self._prefix + name)
+
+
+def main(argv=None):
+    # Imported here: both import this module
+    from .records import RecordTable
+    from .store import THREATS_FILE, ThreatStore
+
+    parser = argparse.ArgumentParser(description="Convert threats between a JSON file and a binary snapshot")
+    parser.add_argument('source', nargs='?', help="JSON threats file (binary snapshot with --to-json)")
+    parser.add_argument('target', nargs='?', help="file to (re)write")
+    parser.add_argument('--to-json', action='store_true', help="convert a binary snapshot to a JSON file")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.to_json:
+        source = args.source or THREATS_FILE + BINARY_SUFFIX
+        target = args.target or (source[:-len(BINARY_SUFFIX)] if source.endswith(BINARY_SUFFIX)
+                                 else source + '.json')
+        try:
+            with Snapshot(source) as snapshot:
+                records = RecordTable.restore(snapshot.sections('records'))
+        except (OSError, ValueError) as e:
+            print(f"Cannot read {source}: {e}")
+            return 1
+        # Through the store, so its writers are locked out and its journal reset
+        try:
+            ThreatStore(target).overwrite(records.values())
+        except ValueError as e:
+            print(f"Not overwriting {target}: {e}. Write the JSON elsewhere, "
+                  f"or stop the server and remove the journal to drop those writes.")
+            return 1
+        count = len(records)
+    else:
+        source = args.source or THREATS_FILE
+        target = args.target or source + BINARY_SUFFIX
+        store = ThreatStore(source)
+        store.refresh()
+        if not store.loaded:
+            print(f"No threats found at {source}")
+            return 1
+        if store.document is not None:
+            print(f"{source} is not a list of threats")
+            return 1
+        count = store.save_binary(target)
+    print(f"Converted {count} threats from {source} to {target} "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
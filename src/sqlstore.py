@@ -0,0 +1,613 @@
+"""SQLite storage backend and migration tool.
+
+SQLiteThreatStore offers the same interface as ThreatStore but keeps the
+threats in an indexed SQLite database instead of memory, so memory use
+and cold starts no longer grow with the data set. Select it by giving the
+server a .db path:
+
+    THREATS_STORE=data/processed/threats.db python src/app.py
+
+Run as a module to migrate a JSON threats file (and its journal) into a
+database:
+
+    python -m src.sqlstore [data/processed/threats.json] [data/processed/threats.db]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from .aggregates import confidence_bucket, confidence_value
+from .canonical import canonicalize, field_error, merge_sighting, new_sighting
+from .changes import ChangeFeed
+from .expiry import TTLPolicy, parse_time
+from .metrics import STORE_SECONDS
+from .indexes import FILTER_FIELDS, check_page_query, decode_cursor, encode_cursor, timestamp_key
+from .lookup import covering_keys, observable_key
+from .store import BULK_REBUILD_MIN, THREATS_FILE, ThreatStore
+from .trends import INTERVALS, bucket_start, check_trend_query, trend_series
+
+THREATS_DB = 'data/processed/threats.db'
+
+# Indicators per "IN (...)" query in lookup() and match()
+LOOKUP_CHUNK = 500
+
+# Table statistics are refreshed (ANALYZE) whenever the row count has doubled
+# since the last run, so the planner keeps picking the selective index for
+# filtered, sorted pages. Smaller tables are not worth it.
+ANALYZE_MIN_ROWS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threats (
+    id INTEGER PRIMARY KEY,
+    indicator TEXT UNIQUE,
+    type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    bucket TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL,
+    seen REAL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS threats_type ON threats (type);
+CREATE INDEX IF NOT EXISTS threats_source ON threats (source);
+CREATE INDEX IF NOT EXISTS threats_severity ON threats (severity);
+CREATE INDEX IF NOT EXISTS threats_timestamp ON threats (timestamp);
+CREATE INDEX IF NOT EXISTS threats_confidence ON threats (confidence);
+
+CREATE TABLE IF NOT EXISTS counts (
+    field TEXT NOT NULL,
+    value NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (field, value)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollups (
+    interval TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    value NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (interval, bucket, field, value)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+"""
+
+# Created after upgrade() has added the columns they cover to older databases
+UPGRADE_SCHEMA = """
+CREATE INDEX IF NOT EXISTS threats_expires ON threats (expires);
+"""
+
+# Aggregate counters kept in the counts table: (stats field, value expression)
+COUNTERS = (
+    ('total', "''"),
+    ('types', '{row}.type'),
+    ('sources', '{row}.source'),
+    ('severities', '{row}.severity'),
+    ('confidence', '{row}.bucket'),
+    ('source_types', 'json_array({row}.source, {row}.type)'),
+)
+
+
+def _counter_triggers():
+    increment = ''.join(
+        f"INSERT INTO counts VALUES ('{field}', {value.format(row='NEW')}, 1)"
+        f" ON CONFLICT (field, value) DO UPDATE SET count = count + 1;\n"
+        for field, value in COUNTERS)
+    decrement = ''.join(
+        f"UPDATE counts SET count = count - 1"
+        f" WHERE field = '{field}' AND value = {value.format(row='OLD')};\n"
+        for field, value in COUNTERS)
+    return f"""
+CREATE TRIGGER IF NOT EXISTS threats_insert AFTER INSERT ON threats BEGIN
+{increment}END;
+CREATE TRIGGER IF NOT EXISTS threats_delete AFTER DELETE ON threats BEGIN
+{decrement}END;
+CREATE TRIGGER IF NOT EXISTS threats_update AFTER UPDATE OF type, source, severity, bucket ON threats BEGIN
+{decrement}{increment}END;
+"""
+
+
+# Trend rollups kept per interval bucket of the first sighting: (group, value expression)
+ROLLUPS = (
+    ('total', "''"),
+    ('types', '{row}.type'),
+    ('sources', '{row}.source'),
+    ('severities', '{row}.severity'),
+)
+
+
+def _rollup_triggers():
+    increment, decrement = '', ''
+    for interval, size in INTERVALS.items():
+        for field, value in ROLLUPS:
+            increment += (
+                f"INSERT INTO rollups SELECT '{interval}', CAST(NEW.seen / {size} AS INTEGER) * {size},"
+                f" '{field}', {value.format(row='NEW')}, 1 WHERE NEW.seen IS NOT NULL"
+                f" ON CONFLICT (interval, bucket, field, value) DO UPDATE SET count = count + 1;\n")
+            decrement += (
+                f"UPDATE rollups SET count = count - 1 WHERE interval = '{interval}'"
+                f" AND bucket = CAST(OLD.seen / {size} AS INTEGER) * {size}"
+                f" AND field = '{field}' AND value = {value.format(row='OLD')};\n")
+    return f"""
+CREATE TRIGGER IF NOT EXISTS rollups_insert AFTER INSERT ON threats BEGIN
+{increment}END;
+CREATE TRIGGER IF NOT EXISTS rollups_delete AFTER DELETE ON threats BEGIN
+{decrement}END;
+CREATE TRIGGER IF NOT EXISTS rollups_update AFTER UPDATE OF type, source, severity, seen ON threats BEGIN
+{decrement}{increment}END;
+"""
+
+
+class SQLiteThreatStore:
+    """Threat store backed by a SQLite database (see ThreatStore for the interface).
+
+    Rows keep the full record as JSON next to indexed columns for the
+    canonical indicator, the filter fields and the sort keys, so paging
+    and lookups are index range scans. Triggers maintain the aggregate
+    counters in the same transaction as every write, which makes stats()
+    a read of a few hundred rows at most.
+
+    The database runs in WAL mode: readers never block the (single)
+    writer, and other processes can share the file. Every write
+    transaction bumps a version number in the meta table; refresh()
+    compares it to the last one seen to notice other processes' writes.
+
+    Each row also stores when it expires under the TTL policy, so expire()
+    is a range scan of the expires index, and when it was first seen,
+    from which triggers maintain the hourly and daily trend rollups.
+    """
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl or TTLPolicy()
+        self.version = None
+        self.loaded = False
+        self.document = None
+        self.changes = ChangeFeed()
+        self._id = None
+        self._modified = None
+        self._views = []
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _db(self):
+        """This thread's connection, opened (and the schema created) on first use"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=FULL')
+            db.executescript(SCHEMA)
+            self._upgrade(db)
+            db.executescript(UPGRADE_SCHEMA + _counter_triggers() + _rollup_triggers())
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('id', ?), ('version', 0)", (uuid.uuid4().hex,))
+            self._apply_ttl(db)
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def _upgrade(self, db):
+        """Add the seen/expires columns to a database created before they existed"""
+        if 'expires' in self._table_columns(db):
+            return
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if 'expires' not in self._table_columns(db):
+                db.execute("ALTER TABLE threats ADD COLUMN seen REAL")
+                db.execute("ALTER TABLE threats ADD COLUMN expires REAL")
+                # _apply_ttl() fills them in (and the rollups) once the triggers exist
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('ttl', NULL)")
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _table_columns(self, db):
+        return {row[1] for row in db.execute("PRAGMA table_info(threats)")}
+
+    def _apply_ttl(self, db):
+        """Recompute every row's seen/expires columns if the TTL policy changed"""
+        policy = json.dumps(self.ttl.config(), sort_keys=True)
+        row = db.execute("SELECT value FROM meta WHERE key = 'ttl'").fetchone()
+        if row and row[0] == policy:
+            return
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'ttl'").fetchone()
+            if not (row and row[0] == policy):
+                rows = db.execute("SELECT id, data FROM threats").fetchall()
+                for threat_id, data in rows:
+                    db.execute("UPDATE threats SET seen = ?, expires = ? WHERE id = ?",
+                               self._lifetime(json.loads(data)) + (threat_id,))
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('ttl', ?)", (policy,))
+                # Other processes (and this one's views) pick the new columns up on refresh
+                db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _read_meta(self, db):
+        meta = dict(db.execute("SELECT key, value FROM meta"))
+        self._id = meta['id']
+        self._modified = meta.get('modified')
+        return meta['version']
+
+    def files(self):
+        """{role: path} of the files the store keeps on disk"""
+        return {"database": self.path, "wal": self.path + '-wal'}
+
+    def attach(self, view):
+        """Register a derived view and build it from the current threats"""
+        with self._lock:
+            self.refresh()
+            self._views.append(view)
+            view.rebuild(self._items())
+
+    def _items(self):
+        for threat_id, data in self._db().execute("SELECT id, data FROM threats ORDER BY id"):
+            yield threat_id, json.loads(data)
+
+    def etag(self):
+        """Tag for the current data: the database's id plus its version"""
+        self.refresh()
+        tag = f'{self._id}:{self.version}'.encode()
+        return hashlib.blake2b(tag, digest_size=8).hexdigest()
+
+    def last_modified(self):
+        """Time of the last write, in seconds (None if never written)"""
+        return self._modified
+
+    def refresh(self):
+        """Notice writes made by other processes since the last refresh or write"""
+        version = self._read_meta(self._db())
+        if version == self.version:
+            return False
+        with self._lock:
+            # Re-read: a write by this process may have landed meanwhile
+            version = self._read_meta(self._db())
+            if version == self.version:
+                return False
+            self.version = version
+            self.loaded = version > 0
+            self._reset_views('reload')
+            return True
+
+    def _reset_views(self, event):
+        with STORE_SECONDS.time(operation='build'):
+            for view in self._views:
+                view.rebuild(self._items())
+        self.changes.publish({"type": event})
+
+    def threats(self):
+        """All threats, in insertion order"""
+        self.refresh()
+        return [threat for _, threat in self._items()]
+
+    def get(self, threat_id):
+        """Threat with the given id, or None"""
+        row = self._db().execute("SELECT data FROM threats WHERE id = ?", (threat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def page(self, limit=10, after=None, sort='id', order=None,
+             type=None, source=None, severity=None, min_confidence=None):
+        """One page of threats and the next cursor, with the semantics of ThreatIndex.page"""
+        self.refresh()
+        order = check_page_query(limit, sort, order)
+        after_key = decode_cursor(sort, after) if after else None
+        columns = ('id',) if sort == 'id' else (sort, 'id')
+
+        where, params = [], []
+        for field, value in zip(FILTER_FIELDS, (type, source, severity)):
+            if value is not None:
+                where.append(f'{field} = ?')
+                params.append(value)
+        if min_confidence is not None:
+            where.append('confidence >= ?')
+            params.append(min_confidence)
+        if after_key is not None:
+            if len(after_key) != len(columns):
+                raise ValueError("Cursor does not match sort order")
+            placeholders = ', '.join('?' * len(columns))
+            where.append(f"({', '.join(columns)}) {'>' if order == 'asc' else '<'} ({placeholders})")
+            params.extend(after_key)
+
+        sql = f"SELECT {', '.join(columns)}, data FROM threats"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ' + ', '.join(f'{column} {order}' for column in columns) + ' LIMIT ?'
+        params.append(limit + 1)
+        rows = self._db().execute(sql, params).fetchall()
+        threats = [json.loads(row[-1]) for row in rows[:limit]]
+        cursor = encode_cursor(sort, rows[limit - 1][:-1]) if len(rows) > limit else None
+        return threats, cursor
+
+    def stats(self):
+        """The aggregate counters, in the shape of ThreatAggregates.snapshot()"""
+        self.refresh()
+        stats = {"total": 0, "types": {}, "sources": {}, "severities": {},
+                 "confidence": {}, "source_types": {}}
+        for field, value, count in self._db().execute(
+                "SELECT field, value, count FROM counts WHERE count > 0"):
+            if field == 'total':
+                stats['total'] = count
+            elif field == 'source_types':
+                source, threat_type = json.loads(value)
+                stats['source_types'].setdefault(source, {})[threat_type] = count
+            else:
+                stats[field][value] = count
+        return stats
+
+    def lookup(self, indicators, chunk_size=LOOKUP_CHUNK):
+        """Yield (indicator, [threats]) for each indicator present in the store"""
+        self.refresh()
+        chunk = []
+        for indicator in indicators:
+            chunk.append(indicator)
+            if len(chunk) >= chunk_size:
+                yield from self._lookup_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._lookup_chunk(chunk)
+
+    def _lookup_chunk(self, chunk):
+        keys = {}
+        for indicator in chunk:
+            key = canonicalize(indicator)
+            if key:
+                keys.setdefault(key, indicator)
+        if not keys:
+            return []
+        rows = self._db().execute(
+            f"SELECT indicator, data FROM threats WHERE indicator IN ({', '.join('?' * len(keys))})",
+            list(keys))
+        found = {key: json.loads(data) for key, data in rows}
+        return [(indicator, [found[key]]) for key, indicator in keys.items() if key in found]
+
+    def match(self, observables, chunk_size=LOOKUP_CHUNK):
+        """Covering matches with the semantics of ThreatStore.match.
+
+        Each observable is expanded into the indicators that could cover
+        it (every enclosing network, every parent domain), which are then
+        looked up on the unique indicator index.
+        """
+        self.refresh()
+        chunk = []
+        for observable in observables:
+            chunk.append(observable)
+            if len(chunk) >= chunk_size:
+                yield from self._match_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._match_chunk(chunk)
+
+    def _match_chunk(self, chunk):
+        candidates = {}
+        for observable in chunk:
+            key = canonicalize(observable)
+            if not key or key in candidates:
+                continue
+            target = observable_key(key)
+            keys = covering_keys(target) if target is not None else []
+            if target is None or '://' in key:
+                keys.insert(0, key)
+            candidates[key] = (observable, keys)
+        wanted = list({key for _, keys in candidates.values() for key in keys})
+        found = {}
+        db = self._db()
+        for i in range(0, len(wanted), LOOKUP_CHUNK):
+            batch = wanted[i:i + LOOKUP_CHUNK]
+            rows = db.execute(
+                f"SELECT indicator, data FROM threats WHERE indicator IN ({', '.join('?' * len(batch))})", batch)
+            found.update((key, json.loads(data)) for key, data in rows)
+        matches = []
+        for observable, keys in candidates.values():
+            covering = [(key, [found[key]]) for key in keys if key in found]
+            if covering:
+                matches.append((observable, covering))
+        return matches
+
+    def _write(self, apply):
+        """Run apply(db) in one write transaction and bump the version.
+
+        Returns apply's result and whether other processes had written
+        since our last refresh or write.
+        """
+        db = self._db()
+        started = time.perf_counter()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            version = self._read_meta(db)
+            result = apply(db)
+            self._maybe_analyze(db)
+            self._modified = time.time()
+            db.execute("UPDATE meta SET value = ? WHERE key = 'version'", (version + 1,))
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('modified', ?)", (self._modified,))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        finally:
+            STORE_SECONDS.observe(time.perf_counter() - started, operation='write')
+        behind = version != self.version
+        self.version = version + 1
+        self.loaded = True
+        return result, behind
+
+    def _maybe_analyze(self, db):
+        row = db.execute("SELECT count FROM counts WHERE field = 'total'").fetchone()
+        rows = row[0] if row else 0
+        analyzed = db.execute("SELECT value FROM meta WHERE key = 'analyzed'").fetchone()
+        if rows >= ANALYZE_MIN_ROWS and rows >= 2 * (analyzed[0] if analyzed else 0):
+            db.execute("ANALYZE")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('analyzed', ?)", (rows,))
+
+    def _ingest(self, db, threat):
+        """Insert a threat or merge it into the row for the same canonical indicator"""
+        key = canonicalize(threat.get('indicator'))
+        row = db.execute("SELECT id, data FROM threats WHERE indicator = ?", (key,)).fetchone() if key else None
+        if row is None:
+            record = new_sighting(threat, key) if key else threat
+            cursor = db.execute(
+                "INSERT INTO threats (indicator, type, source, severity, confidence, bucket, timestamp,"
+                " seen, expires, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key,) + self._columns(record) + (json.dumps(record),))
+            return cursor.lastrowid, None, record
+        existing = json.loads(row[1])
+        record = merge_sighting(existing, threat)
+        db.execute(
+            "UPDATE threats SET type = ?, source = ?, severity = ?, confidence = ?, bucket = ?,"
+            " timestamp = ?, seen = ?, expires = ?, data = ? WHERE id = ?",
+            self._columns(record) + (json.dumps(record), row[0]))
+        return row[0], existing, record
+
+    def _columns(self, record):
+        get = record.get
+        return (
+            str(get('type') or 'unknown'),
+            str(get('source') or 'unknown'),
+            str(get('severity') or 'unknown'),
+            confidence_value(get('confidence')),
+            confidence_bucket(get('confidence')),
+            timestamp_key(record),
+        ) + self._lifetime(record)
+
+    def _lifetime(self, record):
+        """(first seen, expiry) in epoch seconds, for the rollups and expire()"""
+        seen = parse_time(record.get('first_seen') or record.get('timestamp'))
+        # Threats without an indicator have no key to be removed by
+        expires = self.ttl.expires_at(record) if record.get('indicator') else None
+        return seen, expires
+
+    def add(self, threat):
+        """Insert one threat in its own transaction"""
+        self.add_many([threat])
+
+    def add_many(self, threats):
+        """Insert threats in a single transaction (one fsync for the whole batch)"""
+        threats = list(threats)
+        if not threats:
+            return
+        for threat in threats:
+            error = field_error(threat)
+            if error:
+                raise ValueError(error)
+        with self._lock:
+            results, behind = self._write(lambda db: [self._ingest(db, threat) for threat in threats])
+            if behind or len(results) >= BULK_REBUILD_MIN:
+                self._reset_views('reload')
+                return
+            for threat_id, existing, record in results:
+                for view in self._views:
+                    if existing is not None:
+                        view.remove(threat_id, existing)
+                    view.add(threat_id, record)
+                self.changes.publish({"type": "add" if existing is None else "update",
+                                      "id": threat_id, "threat": record})
+
+    def next_expiry(self):
+        """When the next threat expires, in epoch seconds (None if none will)"""
+        return self._db().execute("SELECT MIN(expires) FROM threats").fetchone()[0]
+
+    def expire(self, now=None):
+        """Delete the threats whose TTL has passed; returns how many were removed"""
+        now = time.time() if now is None else now
+        expires = self.next_expiry()
+        if expires is None or expires > now:
+            return 0
+
+        def apply(db):
+            rows = db.execute("SELECT id, data FROM threats WHERE expires <= ?", (now,)).fetchall()
+            db.execute("DELETE FROM threats WHERE expires <= ?", (now,))
+            return [(threat_id, json.loads(data)) for threat_id, data in rows]
+
+        with self._lock:
+            removed, behind = self._write(apply)
+            if behind or len(removed) >= BULK_REBUILD_MIN:
+                self._reset_views('reload')
+                return len(removed)
+            for threat_id, record in removed:
+                for view in self._views:
+                    view.remove(threat_id, record)
+                self.changes.publish({"type": "remove", "id": threat_id, "threat": record})
+        return len(removed)
+
+    def trends(self, interval='hour', buckets=None, until=None):
+        """Counts per `interval` bucket with the semantics of ThreatStore.trends"""
+        buckets = check_trend_query(interval, buckets)
+        until = time.time() if until is None else until
+        size = INTERVALS[interval]
+        end = bucket_start(until, size)
+        rollups = {}
+        for bucket, field, value, count in self._db().execute(
+                "SELECT bucket, field, value, count FROM rollups"
+                " WHERE interval = ? AND bucket BETWEEN ? AND ? AND count > 0",
+                (interval, end - (buckets - 1) * size, end)):
+            rollups.setdefault(bucket, {})[None if field == 'total' else (field, value)] = count
+        return trend_series(rollups, interval, buckets, until)
+
+    def clear(self):
+        """Drop every threat"""
+        with self._lock:
+            self._write(self._delete_all)
+            self._reset_views('clear')
+
+    def replace(self, threats):
+        """Swap the whole threat list in one transaction"""
+        def apply(db):
+            self._delete_all(db)
+            for threat in threats:
+                error = field_error(threat)
+                if error:
+                    print(f"Skipping threat that cannot be indexed: {error}")
+                else:
+                    self._ingest(db, threat)
+
+        with self._lock:
+            self._write(apply)
+            self._reset_views('reload')
+
+    def _delete_all(self, db):
+        db.execute("DELETE FROM threats")
+        db.execute("DELETE FROM counts")
+        db.execute("DELETE FROM rollups")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate a JSON threats file into a SQLite database")
+    parser.add_argument('source', nargs='?', default=THREATS_FILE, help="JSON threats file")
+    parser.add_argument('target', nargs='?', default=THREATS_DB, help="SQLite database to (re)write")
+    args = parser.parse_args(argv)
+
+    source = ThreatStore(args.source)
+    source.refresh()
+    if not source.loaded:
+        print(f"No threats found at {args.source}")
+        return 1
+    if source.document is not None:
+        print(f"{args.source} is not a list of threats")
+        return 1
+    threats = source.threats()
+    started = time.perf_counter()
+    SQLiteThreatStore(args.target).replace(threats)
+    print(f"Migrated {len(threats)} threats from {args.source} to {args.target} "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,795 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+
+from .aggregates import ThreatAggregates
+from .canonical import canonicalize, field_error, merge_sighting, new_sighting
+from .changes import ChangeFeed
+from .indexes import ThreatIndex
+from .expiry import ExpiryQueue, TTLPolicy
+from .journal import FileLock, Journal, fsync_directory, write_atomic
+from .jsonstream import iter_json_array
+from .lookup import NetworkIndex, observable_key
+from .metrics import STORE_ERRORS, STORE_SECONDS
+from .records import KeyIndex, RecordTable
+from .snapshot import BINARY_SUFFIX, Snapshot, write_snapshot
+from .trends import TrendRollups, check_trend_query
+
+THREATS_FILE = 'data/processed/threats.json'
+
+# Compaction runs once the journal reaches this size and half the snapshot
+# size, which keeps its O(n) rewrite amortized to O(1) per insert.
+COMPACT_MIN_BYTES = 1024 * 1024
+
+# Batches at least this big (and a quarter of the store) rebuild the views
+# in one pass instead of updating them per threat.
+BULK_REBUILD_MIN = 1000
+
+
+# Store paths with these suffixes are SQLite databases (see sqlstore.py)
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+
+def open_store(path=THREATS_FILE, ttl=None):
+    """ThreatStore (keeping a binary snapshot beside it) for a JSON threats file, SQLiteThreatStore for a database path"""
+    if path.endswith(SQLITE_SUFFIXES):
+        from .sqlstore import SQLiteThreatStore
+        return SQLiteThreatStore(path, ttl)
+    return ThreatStore(path, ttl=ttl, binary_path=path + BINARY_SUFFIX)
+
+
+def stat_signature(path):
+    """(mtime_ns, size, inode) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def serialize_threats(threats):
+    """Yield a snapshot in chunks: a JSON array with one compact threat per line"""
+    yield b'['
+    separator = b'\n'
+    for threat in threats:
+        yield separator + json.dumps(threat).encode()
+        separator = b',\n'
+    yield b'\n]\n'
+
+
+class ThreatStore:
+    """Process-wide in-memory view of the threats file.
+
+    The file is parsed once and served from memory afterwards. Every read
+    calls refresh(), which only costs two os.stat() calls: the data is
+    reloaded when the snapshot or its journal changes on disk (e.g. a
+    collector rewrote threats.json). Writes made through the store update
+    memory directly.
+
+    Writes are appended to a journal next to the snapshot instead of
+    rewriting it, so an insert costs O(1). Loading replays the journal on
+    top of the snapshot, and once the journal grows large it is folded
+    into a fresh snapshot in the background.
+
+    Indicators are canonicalized on the way in (see canonicalize()) and a
+    repeat sighting of a known indicator is merged into the existing
+    record instead of stored again; the journal keeps the raw sightings
+    and replaying it merges them the same way. add_many() rejects threats
+    the views cannot index (see field_error()) before they reach the
+    journal, and loading skips any such threat instead of failing.
+
+    Several processes (e.g. server workers) may share the files. Writes
+    take an exclusive file lock and first replay whatever other processes
+    appended; readers notice those appends through the same two stat()
+    calls and replay only the new journal lines rather than reloading.
+
+    Each threat gets an integer id in insertion order. Derived structures
+    (aggregates, indexes) are kept in sync as "views": objects with
+    rebuild(items), add(threat_id, threat) and remove(threat_id, threat)
+    that the store notifies on every load and write.
+
+    Threats are held column by column in a RecordTable rather than as
+    dicts, which takes several times less memory; a threat dict is built
+    whenever one is read. A view with a `fields` tuple is rebuilt from
+    dicts holding only those fields.
+
+    Threats whose TTL (see TTLPolicy) has passed are removed by expire(),
+    which the server runs periodically; removals are journaled like any
+    other write, so every process drops the same threats.
+
+    Given a `binary_path`, the store also keeps a binary snapshot there
+    (see snapshot.py) holding its columns and prebuilt views, rewritten
+    whenever the JSON snapshot is and after a load that had to parse it.
+    Loading starts from the binary snapshot when it was built from the
+    JSON snapshot on disk, replaying only the journal written since.
+    """
+
+    def __init__(self, path, journal_path=None, ttl=None, binary_path=None):
+        self.path = path
+        self.binary_path = binary_path
+        self.journal = Journal(journal_path or path + '.journal')
+        self.version = 0
+        self.loaded = False
+        self.document = None
+        self._records = RecordTable()
+        # Canonical indicator -> threat id, reading the indicators back from
+        # the records; NetworkIndex holds it too, so it is only changed in place
+        self._keys = KeyIndex(self._indicator)
+        self._next_id = 0
+        self._signature = None
+        self._generation = 0
+        self._compacting = False
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + '.lock')
+        self.aggregates = ThreatAggregates()
+        self.index = ThreatIndex()
+        self.networks = NetworkIndex(self._keys)
+        self.expiry = ExpiryQueue(ttl or TTLPolicy())
+        self.rollups = TrendRollups()
+        self._views = [self.aggregates, self.index, self.networks, self.expiry, self.rollups]
+        self.changes = ChangeFeed()
+
+    def attach(self, view):
+        """Register a derived view and build it from the current threats"""
+        with self._lock:
+            self._views.append(view)
+            self._rebuild(view)
+
+    def _rebuild(self, view):
+        view.rebuild(self._records.items(getattr(view, 'fields', None)))
+
+    def files(self):
+        """{role: path} of the files the store keeps on disk"""
+        files = {"snapshot": self.path, "journal": self.journal.path}
+        if self.binary_path:
+            files["binary"] = self.binary_path
+        return files
+
+    def _current_signature(self):
+        return (stat_signature(self.path), stat_signature(self.journal.path))
+
+    def etag(self):
+        """Tag for the current data, derived from the on-disk snapshot and journal.
+
+        Every change is persisted before it is visible, so equal tags mean
+        equal data - across restarts and across processes sharing the files.
+        """
+        self.refresh()
+        signature = repr(self._signature).encode()
+        return hashlib.blake2b(signature, digest_size=8).hexdigest()
+
+    def last_modified(self):
+        """Most recent mtime of the snapshot or journal, in seconds (None if neither exists)"""
+        mtimes = [sig[0] for sig in self._signature or () if sig]
+        return max(mtimes) / 1e9 if mtimes else None
+
+    def refresh(self):
+        """Catch up if the snapshot or journal changed on disk since the last load or write"""
+        if self._current_signature() == self._signature:
+            return False
+        with self._lock:
+            return self._catch_up()
+
+    def _catch_up(self):
+        signature = self._current_signature()
+        if signature == self._signature:
+            return False
+        if self._signature is not None and signature[0] == self._signature[0] and self.document is None:
+            # Same snapshot: only the journal grew, so replay just the new lines
+            with STORE_SECONDS.time(operation='catch_up'):
+                ops = self.journal.catch_up()
+                if ops is not None:
+                    self._apply(ops)
+                self._signature = signature
+                return True
+        self._load()
+        return True
+
+    def _apply(self, ops):
+        """Replay journal operations appended by another process"""
+        threats = []
+        for op in ops:
+            if op.get("op") == "add":
+                threats.append(op["threat"])
+            elif op.get("op") == "remove":
+                if threats:
+                    self._ingest_many(threats)
+                    threats = []
+                for key in op["indicators"]:
+                    self._remove(key)
+                self.version += 1
+            elif op.get("op") == "clear":
+                threats = []
+                self.document = None
+                self._reset_records([], event='clear')
+        if threats:
+            self._ingest_many(threats)
+        if ops:
+            self.loaded = True
+
+    def _load(self):
+        """Reload from disk: the binary snapshot if it matches, else by parsing the JSON snapshot.
+
+        The file lock is held while the journal is recovered and the
+        binary snapshot restored, but not while the JSON snapshot is
+        parsed: the file is opened under the lock, and keeps reading the
+        same data if a compaction renames another into its place.
+        """
+        snapshot_file = None
+        with self._file_lock:
+            snapshot = stat_signature(self.path)
+            with STORE_SECONDS.time(operation='replay'):
+                recovered = self.journal.recover(snapshot)
+            covered = self._restore_binary(snapshot, len(recovered)) if self.binary_path else None
+            if covered is not None:
+                self.document = None
+                self.loaded = True
+                with STORE_SECONDS.time(operation='build'):
+                    self._apply(recovered[covered:])
+                self.version += 1
+                self.changes.publish({"type": "reload"})
+                self._signature = self._current_signature()
+                self._generation += 1
+                return
+
+            ops, cleared = [], False
+            for op in recovered:
+                if op.get("op") == "clear":
+                    ops, cleared = [], True
+                else:
+                    ops.append(op)
+            if not cleared and snapshot is not None:
+                try:
+                    snapshot_file = open(self.path, 'rb')
+                except FileNotFoundError:
+                    snapshot = None
+            signature = (snapshot, stat_signature(self.journal.path))
+            position = self._journal_position()
+
+        self._clear_records()
+        document, loaded, failed = None, bool(recovered), False
+        if snapshot_file is not None:
+            try:
+                with snapshot_file, STORE_SECONDS.time(operation='parse'):
+                    document, found = self._read_snapshot(snapshot_file)
+                loaded = loaded or found
+            except Exception as e:
+                STORE_ERRORS.inc(operation='load')
+                print(f"Error loading data: {e}")
+                self._clear_records()
+                failed = True
+
+        self.document = document
+        self.loaded = loaded
+        with STORE_SECONDS.time(operation='build'):
+            self._reset_records((), ops, clear=False)
+        # Anything written since the lock was released is caught up on by the next refresh()
+        self._signature = signature
+        self._generation += 1
+        if (self.binary_path and snapshot is not None and loaded and document is None
+                and not failed and not self._binary_matches(snapshot, position)):
+            # So that the next load can skip parsing
+            self._try_save_binary(self._capture(), snapshot, position)
+
+    def _binary_matches(self, snapshot, journal):
+        # Another process may have written it while this one was parsing
+        try:
+            with Snapshot(self.binary_path) as binary:
+                header = binary.header
+        except (OSError, ValueError):
+            return False
+        return header.get('source') == list(snapshot) and header.get('journal') == journal
+
+    def _restore_binary(self, snapshot, entries):
+        """Load the binary snapshot if it was built from `snapshot` and the journal on disk.
+
+        Returns how many of the journal's `entries` it already holds, or
+        None (leaving the store to parse the JSON snapshot) if there is no
+        usable binary snapshot.
+        """
+        try:
+            binary = Snapshot(self.binary_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring binary snapshot: {e}")
+            return None
+        with binary:
+            covered = self._covered_entries(binary.header, snapshot, entries)
+            if covered is None:
+                print(f"Binary snapshot {self.binary_path} is stale, loading {self.path}")
+                return None
+            try:
+                with STORE_SECONDS.time(operation='restore'):
+                    self._restore(binary)
+            except Exception as e:
+                STORE_ERRORS.inc(operation='restore')
+                print(f"Error loading binary snapshot: {e}")
+                return None
+        return covered
+
+    def _covered_entries(self, header, snapshot, entries):
+        if snapshot is None or header.get('source') != list(snapshot):
+            return None
+        position = header.get('journal')
+        if position is None:
+            return 0
+        # Journal lines are only ever appended, so the same file holds the same prefix
+        inode, size, count = position
+        journal = stat_signature(self.journal.path)
+        if journal is None or journal[2] != inode or self.journal.size < size or entries < count:
+            return None
+        return count
+
+    def _restore(self, binary):
+        header = binary.header
+        records = RecordTable.restore(binary.sections('records'))
+        self._records = records
+        self._keys.rebuild(binary.get('store.keys'))
+        self._next_id = header['next_id']
+        names = header['views']
+        for i, view in enumerate(self._views):
+            restored = (i < len(names) and names[i] == type(view).__name__ and hasattr(view, 'restore')
+                        and view.restore(binary.sections(f'view{i}'), records))
+            if not restored:
+                self._rebuild(view)
+
+    def _indicator(self, threat_id):
+        # Keyed records always hold their canonical indicator in its column
+        return self._records.text('indicator', threat_id)
+
+    def _capture(self, records=None):
+        """Copy what goes into a binary snapshot; called with the lock held.
+
+        Views are copied by their dump(); turning the copies into bytes
+        is left to _save_binary(), which can run after the lock is released.
+        """
+        views = self._views
+        return {
+            'records': records if records is not None else self._records.copy(),
+            'keys': array('I', self._keys.values()),
+            'next_id': self._next_id,
+            'names': [type(view).__name__ if hasattr(view, 'dump') else None for view in views],
+            'views': [view.dump() if hasattr(view, 'dump') else None for view in views],
+        }
+
+    def _journal_position(self):
+        """Which journal lines the store holds, for a binary snapshot: None if none"""
+        if not self.journal.entries:
+            return None
+        return [stat_signature(self.journal.path)[2], self.journal.size, self.journal.entries]
+
+    def _save_binary(self, capture, source, journal, path=None):
+        sections = {'store': {'keys': capture['keys']}, 'records': capture['records'].dump()}
+        for i, dump in enumerate(capture['views']):
+            if dump is not None:
+                sections[f'view{i}'] = dump()
+        header = {
+            'source': list(source) if source else None,
+            'journal': journal,
+            'next_id': capture['next_id'],
+            'count': len(capture['records']),
+            'views': capture['names'],
+        }
+        with STORE_SECONDS.time(operation='dump'):
+            write_snapshot(path or self.binary_path, header, sections)
+
+    def _try_save_binary(self, capture, source, journal):
+        try:
+            self._save_binary(capture, source, journal)
+        except Exception as e:
+            STORE_ERRORS.inc(operation='dump')
+            print(f"Error writing binary snapshot: {e}")
+
+    def save_binary(self, path=None):
+        """Write a binary snapshot of the current threats to `path` (default binary_path).
+
+        Returns how many threats it holds.
+        """
+        self.refresh()
+        with self._lock:
+            if self.document is not None:
+                raise ValueError("Threats file is not a list of threats")
+            capture = self._capture()
+            source, journal = self._signature[0], self._journal_position()
+        self._save_binary(capture, source, journal, path)
+        return len(capture['records'])
+
+    def _read_snapshot(self, f):
+        """Ingest the threats of the snapshot open as `f` as they are parsed; returns (document, found).
+
+        A threats list is decoded one record at a time, so the whole file
+        is never held in memory as text or as a list of dicts. Anything
+        else is returned as the document.
+        """
+        start = b''
+        while not start:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                return None, False
+            start = chunk.lstrip()[:1]
+        f.seek(0)
+        if start != b'[':
+            return json.loads(f.read()), True
+        for threat in iter_json_array(f):
+            self._ingest(threat, notify=False)
+        return None, True
+
+    def _clear_records(self):
+        self._records = RecordTable()
+        self._keys.clear()
+        self._next_id = 0
+
+    def _reset_records(self, threats, ops=(), event='reload', clear=True):
+        if clear:
+            self._clear_records()
+        for threat in threats:
+            self._ingest(threat, notify=False)
+        for op in ops:
+            if op.get("op") == "add":
+                self._ingest(op["threat"], notify=False)
+            elif op.get("op") == "remove":
+                for key in op["indicators"]:
+                    self._remove(key, notify=False)
+        self.version += 1
+        for view in self._views:
+            self._rebuild(view)
+        self.changes.publish({"type": event})
+
+    def _ingest(self, threat, notify=True):
+        """Insert a threat or merge it into the record for the same canonical indicator.
+
+        Returns its id, or None if it cannot be indexed and was skipped.
+        """
+        error = field_error(threat)
+        if error:
+            STORE_ERRORS.inc(operation='ingest')
+            print(f"Skipping threat that cannot be indexed: {error}")
+            return None
+        key = canonicalize(threat.get('indicator'))
+        threat_id = self._keys.get(key) if key else None
+        if threat_id is None:
+            threat_id = self._next_id
+            self._next_id += 1
+            record = new_sighting(threat, key) if key else threat
+            self._records[threat_id] = record
+            if key:
+                self._keys[key] = threat_id
+            if notify:
+                for view in self._views:
+                    view.add(threat_id, record)
+                self.changes.publish({"type": "add", "id": threat_id, "threat": record})
+            return threat_id
+        existing = self._records[threat_id]
+        record = merge_sighting(existing, threat)
+        self._records[threat_id] = record
+        if notify:
+            for view in self._views:
+                view.remove(threat_id, existing)
+                view.add(threat_id, record)
+            self.changes.publish({"type": "update", "id": threat_id, "threat": record})
+        return threat_id
+
+    def _remove(self, key, notify=True):
+        """Drop the record for a canonical indicator, if there is one"""
+        threat_id = self._keys.pop(key, None)
+        if threat_id is None:
+            return None
+        record = self._records.pop(threat_id)
+        if notify:
+            for view in self._views:
+                view.remove(threat_id, record)
+            self.changes.publish({"type": "remove", "id": threat_id, "threat": record})
+        return record
+
+    def _ingest_many(self, threats):
+        rebuild = len(threats) >= BULK_REBUILD_MIN and len(threats) * 4 > len(self._records)
+        for threat in threats:
+            self._ingest(threat, notify=not rebuild)
+        if rebuild:
+            for view in self._views:
+                self._rebuild(view)
+            self.changes.publish({"type": "reload"})
+        self.loaded = True
+        self.version += 1
+
+    def threats(self):
+        """Copy of the current threat list, in insertion order"""
+        self.refresh()
+        with self._lock:
+            return list(self._records.values())
+
+    def get(self, threat_id):
+        """Threat with the given id, or None"""
+        return self._records.get(threat_id)
+
+    def page(self, **query):
+        """One page of threats from the secondary indexes (see ThreatIndex.page)"""
+        self.refresh()
+        with self._lock:
+            ids, cursor = self.index.page(**query)
+            return [self._records[i] for i in ids], cursor
+
+    def stats(self):
+        """Consistent copy of the aggregate counters"""
+        self.refresh()
+        with self._lock:
+            return self.aggregates.snapshot()
+
+    def trends(self, interval='hour', buckets=None, until=None):
+        """Counts per `interval` bucket for the `buckets` buckets up to `until` (default now)"""
+        buckets = check_trend_query(interval, buckets)
+        self.refresh()
+        with self._lock:
+            return self.rollups.series(interval, buckets, time.time() if until is None else until)
+
+    def lookup(self, indicators, chunk_size=10000):
+        """Yield (indicator, [threats]) for each indicator present in the store.
+
+        The lock is taken per chunk so a huge batch does not stall writers.
+        """
+        self.refresh()
+        chunk = []
+        for indicator in indicators:
+            chunk.append(indicator)
+            if len(chunk) >= chunk_size:
+                yield from self._lookup_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._lookup_chunk(chunk)
+
+    def _lookup_chunk(self, chunk):
+        keys = {}
+        for indicator in chunk:
+            key = canonicalize(indicator)
+            if key:
+                keys.setdefault(key, indicator)
+        with self._lock:
+            found = []
+            for key, indicator in keys.items():
+                threat_id = self._keys.get(key)
+                if threat_id is not None:
+                    found.append((indicator, [self._records[threat_id]]))
+        return found
+
+    def match(self, observables, chunk_size=10000):
+        """Yield (observable, [(indicator, [threats])]) for each observable a stored indicator covers.
+
+        Besides exact matches, an IP address or range is covered by every
+        stored network containing it, and a hostname (or a URL's host) by
+        every stored parent domain.
+        """
+        self.refresh()
+        chunk = []
+        for observable in observables:
+            chunk.append(observable)
+            if len(chunk) >= chunk_size:
+                yield from self._match_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._match_chunk(chunk)
+
+    def _match_chunk(self, chunk):
+        keys = {}
+        for observable in chunk:
+            key = canonicalize(observable)
+            if key and key not in keys:
+                keys[key] = (observable, observable_key(key))
+        found = []
+        with self._lock:
+            for key, (observable, target) in keys.items():
+                covering = self.networks.match(target) if target is not None else []
+                if target is None or '://' in key:
+                    threat_id = self._keys.get(key)
+                    if threat_id is not None:
+                        covering = [(key, [threat_id])] + covering
+                if covering:
+                    found.append((observable, [(indicator, [self._records[i] for i in ids])
+                                               for indicator, ids in covering]))
+        return found
+
+    def add(self, threat):
+        """Append one threat to the journal and wait for it to be durable"""
+        self.add_many([threat])
+
+    def add_many(self, threats):
+        """Append threats with one journal write and one fsync for the whole batch"""
+        threats = list(threats)
+        if not threats:
+            return
+        for threat in threats:
+            error = field_error(threat)
+            if error:
+                raise ValueError(error)
+        with self._lock, self._file_lock:
+            self._catch_up()
+            if self.document is not None:
+                raise ValueError("Threats file is not a list of threats")
+            with STORE_SECONDS.time(operation='append'):
+                ticket = self.journal.append_many([{"op": "add", "threat": threat} for threat in threats])
+            with STORE_SECONDS.time(operation='ingest'):
+                self._ingest_many(threats)
+            self._signature = self._current_signature()
+            compact = self._should_compact()
+        with STORE_SECONDS.time(operation='sync'):
+            self.journal.sync(ticket)
+        if compact:
+            self._start_compaction()
+
+    def clear(self):
+        """Drop every threat"""
+        with self._lock, self._file_lock:
+            self._catch_up()
+            ticket = self.journal.append({"op": "clear"})
+            self.document = None
+            self.loaded = True
+            self._reset_records([], event='clear')
+            self._signature = self._current_signature()
+        self.journal.sync(ticket)
+
+    def next_expiry(self):
+        """When the next threat expires, in epoch seconds (None if none will)"""
+        with self._lock:
+            return self.expiry.next_expiry()
+
+    def expire(self, now=None):
+        """Remove the threats whose TTL has passed; returns how many were removed.
+
+        Cheap when nothing is due: it only peeks at the top of the expiry heap.
+        """
+        now = time.time() if now is None else now
+        self.refresh()
+        expires = self.next_expiry()
+        if expires is None or expires > now:
+            return 0
+        with self._lock, self._file_lock:
+            # Another process may have expired (or refreshed) some of them already
+            self._catch_up()
+            keys = []
+            for threat_id in self.expiry.due(now):
+                key = canonicalize(self._records[threat_id].get('indicator'))
+                if key and self._keys.get(key) == threat_id:
+                    keys.append(key)
+            if not keys:
+                return 0
+            ticket = self.journal.append({"op": "remove", "indicators": keys})
+            for key in keys:
+                self._remove(key)
+            self.version += 1
+            self._signature = self._current_signature()
+            compact = self._should_compact()
+        with STORE_SECONDS.time(operation='sync'):
+            self.journal.sync(ticket)
+        if compact:
+            self._start_compaction()
+        return len(keys)
+
+    def replace(self, threats):
+        """Swap the whole threat list, rewriting the snapshot and resetting the journal.
+
+        `threats` can be any iterable (the collector passes a generator):
+        each threat is ingested as it is written, so they are never all
+        held as dicts.
+        """
+        with self._lock, self._file_lock:
+            self._clear_records()
+            try:
+                with STORE_SECONDS.time(operation='serialize'):
+                    tmp_path = write_atomic(self.path, serialize_threats(self._ingesting(threats)), rename=False)
+                self.document = None
+                self.loaded = True
+                self._reset_records((), clear=False)
+                self._generation += 1
+                # The rename keeps the signature, so the binary snapshot is in place
+                # and current before any other process sees the new JSON snapshot
+                source = stat_signature(tmp_path)
+                if self.binary_path:
+                    self._try_save_binary(self._capture(), source, None)
+                os.replace(tmp_path, self.path)
+                fsync_directory(os.path.dirname(self.path))
+                self.journal.reset(source)
+            except BaseException:
+                # Memory may hold the new threats and the file the old ones: reload on next read
+                self._signature = None
+                raise
+            self._signature = self._current_signature()
+
+    def _ingesting(self, threats):
+        for threat in threats:
+            # Serialized before it is ingested, exactly as it was given
+            yield threat
+            self._ingest(threat, notify=False)
+
+    def overwrite(self, threats):
+        """Rewrite the snapshot with threats from outside the store (e.g. a binary snapshot).
+
+        Like replace(), but nothing is loaded: refresh() picks the file up
+        as it would another process's write. Raises ValueError instead if
+        the journal holds writes the snapshot does not, which rewriting it
+        would drop without a trace.
+        """
+        with self._lock, self._file_lock:
+            pending = len(self.journal.recover(stat_signature(self.path)))
+            if pending:
+                raise ValueError(f"{self.journal.path} holds {pending} writes not yet in {self.path}")
+            with STORE_SECONDS.time(operation='serialize'):
+                write_atomic(self.path, serialize_threats(threats))
+            self.journal.reset(stat_signature(self.path))
+
+    def _should_compact(self):
+        snapshot = self._signature[0]
+        snapshot_size = snapshot[1] if snapshot else 0
+        return self.journal.size >= max(COMPACT_MIN_BYTES, snapshot_size // 2)
+
+    def _start_compaction(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            STORE_ERRORS.inc(operation='compact')
+            print(f"Error compacting journal: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot via atomic renames.
+
+        The snapshot is serialized without holding the lock; writes that
+        land meanwhile are carried over into the new journal. The new
+        journal is written before the snapshot is renamed into place, so a
+        crash at any point leaves a snapshot/journal pair that recovers
+        to the same data. The binary snapshot is renamed into place just
+        before it, so other processes restore that instead of parsing.
+        """
+        with STORE_SECONDS.time(operation='compact'):
+            return self._compact()
+
+    def _compact(self):
+        with self._lock:
+            self.refresh()
+            if self.document is not None:
+                return False
+            generation = self._generation
+            # Copies the columns, not the threats; those are built while writing
+            records = self._records.copy()
+            capture = self._capture(records) if self.binary_path else None
+            offset = self.journal.size
+        suffix = f'.compact-{os.getpid()}'
+        with STORE_SECONDS.time(operation='serialize'):
+            tmp_path = write_atomic(self.path, serialize_threats(records.values()), rename=False, suffix=suffix)
+        source = stat_signature(tmp_path)
+        binary_tmp = None
+        if capture is not None:
+            # Holds exactly what the new JSON snapshot does, whose signature the
+            # rename keeps; installed first, so no other process parses the JSON
+            try:
+                self._save_binary(capture, source, None, self.binary_path + suffix)
+                binary_tmp = self.binary_path + suffix
+            except Exception as e:
+                STORE_ERRORS.inc(operation='dump')
+                print(f"Error writing binary snapshot: {e}")
+        with self._lock, self._file_lock:
+            self._catch_up()
+            if generation != self._generation:
+                # Reloaded, replaced or compacted by another process while we were writing
+                os.remove(tmp_path)
+                if binary_tmp:
+                    os.remove(binary_tmp)
+                return False
+            self.journal.prepare(source, self.journal.tail(offset))
+            if binary_tmp:
+                os.replace(binary_tmp, self.binary_path)
+            os.replace(tmp_path, self.path)
+            fsync_directory(os.path.dirname(self.path))
+            self.journal.swap()
+            self._signature = self._current_signature()
+        return True
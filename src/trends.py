@@ -0,0 +1,145 @@
+from array import array
+from datetime import datetime, timezone
+
+from .expiry import parse_time
+
+# Rollup granularities, in seconds per bucket
+INTERVALS = {'hour': 3600, 'day': 86400}
+DEFAULT_BUCKETS = {'hour': 48, 'day': 30}
+MAX_BUCKETS = 1000
+
+ROLLUP_FIELDS = (('types', 'type'), ('sources', 'source'), ('severities', 'severity'))
+
+
+def bucket_start(seen, size):
+    return int(seen // size * size)
+
+
+def empty_bucket(start):
+    return {
+        "start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        "total": 0,
+        "types": {},
+        "sources": {},
+        "severities": {},
+    }
+
+
+def trend_series(rollups, interval, buckets, until):
+    """Zero-filled series from {bucket start: {None: total, (group, value): count}}"""
+    size = INTERVALS[interval]
+    end = bucket_start(until, size)
+    series = []
+    for start in range(end - (buckets - 1) * size, end + size, size):
+        bucket = empty_bucket(start)
+        for key, count in rollups.get(start, {}).items():
+            if key is None:
+                bucket["total"] = count
+            elif count > 0:
+                bucket[key[0]][key[1]] = count
+        series.append(bucket)
+    return series
+
+
+def check_trend_query(interval, buckets):
+    """Validate /api/trends arguments, returning the effective bucket count"""
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of: {', '.join(INTERVALS)}")
+    buckets = DEFAULT_BUCKETS[interval] if buckets is None else buckets
+    if not 1 <= buckets <= MAX_BUCKETS:
+        raise ValueError(f"buckets must be between 1 and {MAX_BUCKETS}")
+    return buckets
+
+
+class TrendRollups:
+    """Hourly and daily counts of threats by first sighting, kept as a store view.
+
+    Each bucket holds the total plus counts by type, source and severity,
+    updated on every insert, merge and expiry, so a time series costs
+    O(buckets) regardless of how many threats are stored. Threats without
+    a parseable first_seen/timestamp are not counted.
+    """
+
+    fields = ('type', 'source', 'severity', 'first_seen', 'timestamp')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buckets = {interval: {} for interval in INTERVALS}
+        # (name, value) -> slot in every bucket's array of counts; slot 0 is the total
+        self._names = {None: 0}
+
+    def _keys(self, threat):
+        seen = parse_time(threat.get('first_seen') or threat.get('timestamp'))
+        if seen is None:
+            return None, ()
+        get, names = threat.get, self._names
+        keys = [0]
+        for name, field in ROLLUP_FIELDS:
+            key = (name, str(get(field) or 'unknown'))
+            keys.append(names.setdefault(key, len(names)))
+        return seen, keys
+
+    def rebuild(self, items):
+        self.reset()
+        for threat_id, threat in items:
+            self.add(threat_id, threat)
+
+    def add(self, threat_id, threat):
+        seen, keys = self._keys(threat)
+        if seen is None:
+            return
+        for interval, size in INTERVALS.items():
+            buckets = self._buckets[interval]
+            start = bucket_start(seen, size)
+            counts = buckets.get(start)
+            if counts is None:
+                counts = buckets[start] = array('I', bytes(4 * len(self._names)))
+            elif len(counts) < len(self._names):
+                # Names seen since the bucket was made start at zero
+                counts.frombytes(bytes(4 * (len(self._names) - len(counts))))
+            for key in keys:
+                counts[key] += 1
+
+    def remove(self, threat_id, threat):
+        seen, keys = self._keys(threat)
+        if seen is None:
+            return
+        for interval, size in INTERVALS.items():
+            buckets = self._buckets[interval]
+            start = bucket_start(seen, size)
+            counts = buckets[start]
+            for key in keys:
+                counts[key] -= 1
+            if not counts[0]:
+                del buckets[start]
+
+    def dump(self):
+        """Copy the rollups for a binary snapshot; returns a function giving its sections"""
+        sections = {interval: [[start, counts.tolist()] for start, counts in buckets.items()]
+                    for interval, buckets in self._buckets.items()}
+        sections['names'] = list(self._names)
+        return lambda: sections
+
+    def restore(self, sections, records):
+        """Load what dump() saved; returns False (to be rebuilt) if the intervals changed since"""
+        if any(interval not in sections for interval in INTERVALS):
+            return False
+        # JSON turns the (name, value) tuples into lists
+        self._names = {tuple(key) if key is not None else None: slot
+                       for slot, key in enumerate(sections['names'])}
+        for interval in INTERVALS:
+            self._buckets[interval] = {start: array('I', counts) for start, counts in sections[interval]}
+        return True
+
+    def series(self, interval, buckets, until):
+        """`buckets` consecutive buckets of `interval` ending with the one containing `until`"""
+        size = INTERVALS[interval]
+        end = bucket_start(until, size)
+        counted, names = self._buckets[interval], list(self._names)
+        rollups = {}
+        for start in range(end - (buckets - 1) * size, end + size, size):
+            if start in counted:
+                rollups[start] = dict(zip(names, counted[start]))
+        return trend_series(rollups, interval, buckets, until)
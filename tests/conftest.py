@@ -0,0 +1,6 @@
+def threat(name, **fields):
+    return dict({'indicator': name, 'type': 'malware', 'source': 'test', 'severity': 'high'}, **fields)
+
+
+def indicators(store):
+    return [t['indicator'] for t in store.threats()]
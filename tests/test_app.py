@@ -0,0 +1,84 @@
+import pytest
+
+import src.app as server
+from src.store import open_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = open_store(str(tmp_path / 'threats.json'))
+    monkeypatch.setattr(server, 'store', store)
+    server.response_cache.clear()
+    return store
+
+
+@pytest.fixture
+def client(store):
+    return server.app.test_client()
+
+
+def test_add_threat(client, store):
+    response = client.post('/api/add_threat', json={'indicator': 'evil.com', 'type': 'phishing'})
+    assert response.status_code == 200
+    assert [t['indicator'] for t in store.threats()] == ['evil.com']
+
+
+@pytest.mark.parametrize('threat', [
+    {},
+    {'type': 'phishing'},
+    {'indicator': ['evil.com']},
+    {'indicator': 'evil.com', 'type': ['x']},
+    {'indicator': 'evil.com', 'source': {'name': 'x'}},
+    {'indicator': 'evil.com', 'sources': 'x'},
+])
+def test_add_threat_rejects_invalid_threats(client, store, threat):
+    response = client.post('/api/add_threat', json=threat)
+    assert response.status_code == 400
+    assert not store.journal.entries
+    assert client.get('/api/data').status_code == 200
+
+
+def test_pages_are_served_from_the_response_cache(client):
+    hits = server.response_cache.hits
+    first = client.get('/dashboard', headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == 200 and first.headers['Content-Encoding'] == 'gzip'
+    second = client.get('/dashboard', headers={'Accept-Encoding': 'gzip'})
+    assert second.data == first.data
+    assert server.response_cache.hits == hits + 1
+    revalidated = client.get('/dashboard', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_streams_beyond_the_limit_are_turned_away(client, monkeypatch):
+    monkeypatch.setattr(server, 'stream_slots', server.stream_slots)
+    server.limit_streams(1)
+    first = client.get('/api/stream')
+    assert first.status_code == 200
+    turned_away = client.get('/api/stream')
+    assert turned_away.status_code == 503
+    assert turned_away.headers['Retry-After'] == str(server.STREAM_RETRY_AFTER)
+    # Ordinary requests are unaffected, and closing the stream frees its slot
+    assert client.get('/api/data').status_code == 200
+    first.close()
+    second = client.get('/api/stream')
+    assert second.status_code == 200
+    second.close()
+
+
+def test_add_threats_skips_invalid_records(client, store):
+    body = '\n'.join([
+        '{"indicator": "a.com", "type": "domain"}',
+        '{"indicator": "b.com", "type": ["domain"]}',
+        'not json',
+        '["c.com"]',
+        '{"type": "domain"}',
+        '{"indicator": {"value": "d.com"}}',
+        '{"indicator": "e.com", "source": "feed"}',
+    ])
+    response = client.post('/api/add_threats', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['ingested'], result['rejected']) == (2, 5)
+    assert [error['line'] for error in result['errors']] == [2, 3, 4, 5, 6]
+    assert [t['indicator'] for t in store.threats()] == ['a.com', 'e.com']
+    assert client.get('/api/data').get_json()['total'] == 2
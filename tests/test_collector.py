@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from src.collector import JsonFeedAdapter, UrlhausAdapter, build_adapters, collect_feeds, main
+from src.store import ThreatStore
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+URLHAUS = os.path.join(FIXTURES, 'urlhaus.csv')
+
+
+def test_urlhaus_parse():
+    with open(URLHAUS, newline='') as stream:
+        threats = list(UrlhausAdapter().parse(stream))
+    assert [t['indicator'] for t in threats] == [
+        'http://203.0.113.7:8080/bins/mips',
+        'https://evil.example.com/invoice.zip',
+        'HTTPS://Evil.Example.com:443/invoice.zip',
+    ]
+    assert threats[0] == {
+        'indicator': 'http://203.0.113.7:8080/bins/mips',
+        'type': 'url',
+        'source': 'urlhaus',
+        'first_seen': '2026-01-15 11:58:02',
+        'description': 'Malicious URL',
+    }
+
+
+@pytest.mark.parametrize('name,skipped', [('feed.ndjson', 3), ('feed.json', 2)])
+def test_json_feed(name, skipped):
+    adapter = JsonFeedAdapter(os.path.join(FIXTURES, name))
+    threats = adapter.collect()
+    # Records without an indicator, or that the store cannot index, are skipped,
+    # and so are NDJSON lines that are not JSON
+    assert threats == [
+        {'indicator': 'bad-host.example.org', 'type': 'domain', 'severity': 'high', 'confidence': 80,
+         'source': 'json'},
+        {'indicator': '198.51.100.23', 'type': 'ipv4', 'source': 'honeypot'},
+    ]
+    assert adapter.skipped == skipped
+
+
+def test_feeds_are_collected_in_batches():
+    adapters = build_adapters([f'urlhaus={URLHAUS}', f'json={os.path.join(FIXTURES, "feed.ndjson")}'])
+    batches = list(collect_feeds(adapters, batch_size=2))
+    assert sorted(map(len, batches)) == [1, 2, 2]
+    assert sorted(t['source'] for batch in batches for t in batch) == ['honeypot', 'json'] + ['urlhaus'] * 3
+
+
+def test_sample_file_skips_invalid_threats(tmp_path):
+    sample = tmp_path / 'sample.json'
+    sample.write_text('[{"indicator": ["x"]}, "x", {"indicator": "ok.example.com", "type": "domain"}]')
+    output = str(tmp_path / 'threats.json')
+    assert main([f'sample={sample}', '--output', output, '--append']) == 0
+    assert [(t['indicator'], t['source']) for t in ThreatStore(output).threats()] == [('ok.example.com', 'sample')]
+
+
+def test_main_writes_the_store(tmp_path):
+    output = str(tmp_path / 'threats.json')
+    assert main([f'urlhaus={URLHAUS}', '--output', output]) == 0
+    store = ThreatStore(output)
+    # The two spellings of the same URL are merged
+    assert [t['indicator'] for t in store.threats()] == [
+        'http://203.0.113.7:8080/bins/mips',
+        'https://evil.example.com/invoice.zip',
+    ]
+    assert store.threats()[1]['first_seen'] == '2026-01-15 11:47:55'
+
+    assert main([f'json={os.path.join(FIXTURES, "feed.ndjson")}', '--output', output, '--append']) == 0
+    assert ThreatStore(output).stats()['sources'] == {'urlhaus': 2, 'json': 1, 'honeypot': 1}
+
+
+def test_main_rejects_unknown_feeds(tmp_path):
+    with pytest.raises(SystemExit):
+        main(['nosuchfeed', '--output', str(tmp_path / 'threats.json')])
@@ -0,0 +1,86 @@
+import itertools
+import random
+
+import pytest
+
+from src.aggregates import confidence_value
+from src.indexes import ThreatIndex, timestamp_key
+
+TYPES = ('url', 'domain', 'ip')
+SOURCES = ('urlhaus', 'threatfox', 'sample')
+SEVERITIES = ('high', 'medium', 'low')
+
+
+def make_threats(count, seed=1):
+    rng = random.Random(seed)
+    return {i: {'type': rng.choice(TYPES), 'source': rng.choice(SOURCES), 'severity': rng.choice(SEVERITIES),
+                'confidence': rng.choice((10, 50, 75, 90, 100, 120.5, 'high', None)),
+                'timestamp': f'2026-01-{rng.randint(1, 28):02d}T00:00:00'}
+            for i in range(count)}
+
+
+def expected(threats, sort, order, min_confidence=None, **wanted):
+    keys = {'id': lambda i: (i,),
+            'timestamp': lambda i: (timestamp_key(threats[i]), i),
+            'confidence': lambda i: (confidence_value(threats[i].get('confidence')), i)}
+    ids = [i for i, threat in threats.items()
+           if all(threat[field] == value for field, value in wanted.items())
+           and (min_confidence is None or confidence_value(threat.get('confidence')) >= min_confidence)]
+    return sorted(ids, key=keys[sort], reverse=order == 'desc')
+
+
+def walk(index, **query):
+    ids, after = [], None
+    while True:
+        page, after = index.page(limit=7, after=after, **query)
+        ids.extend(page)
+        if after is None:
+            return ids
+
+
+FILTERS = [dict(zip(('type', 'source', 'severity'), values))
+           for values in itertools.product(TYPES + (None,), SOURCES + (None,), SEVERITIES + (None,))]
+
+
+@pytest.fixture(scope='module')
+def threats():
+    threats = make_threats(300)
+    # Leave gaps, and one combination with no threats at all
+    return {i: t for i, t in threats.items() if i % 11 and (t['type'], t['source']) != ('ip', 'sample')}
+
+
+@pytest.mark.parametrize('sort,order', list(itertools.product(('id', 'timestamp', 'confidence'), ('asc', 'desc'))))
+def test_pages_match_a_full_scan(threats, sort, order):
+    index = ThreatIndex()
+    index.rebuild(threats.items())
+    for filters in FILTERS:
+        wanted = {field: value for field, value in filters.items() if value is not None}
+        # On band bounds, inside bands, and above everything
+        for min_confidence in (None, 60, 95, 100, 101, 130):
+            assert walk(index, sort=sort, order=order, min_confidence=min_confidence, **wanted) == \
+                expected(threats, sort, order, min_confidence, **wanted)
+
+
+def test_pages_follow_adds_and_removes(threats):
+    index = ThreatIndex()
+    index.rebuild(threats.items())
+    current = dict(threats)
+    for threat_id in list(current)[::3]:
+        index.remove(threat_id, current.pop(threat_id))
+    for threat_id, threat in make_threats(400, seed=2).items():
+        if threat_id >= 300:
+            index.add(threat_id, threat)
+            current[threat_id] = threat
+    for filters in FILTERS:
+        wanted = {field: value for field, value in filters.items() if value is not None}
+        for sort, min_confidence in itertools.product(('id', 'timestamp', 'confidence'), (None, 95)):
+            assert walk(index, sort=sort, order='desc', min_confidence=min_confidence, **wanted) == \
+                expected(current, sort, 'desc', min_confidence, **wanted)
+
+
+def test_cursor_for_another_sort_is_rejected(threats):
+    index = ThreatIndex()
+    index.rebuild(threats.items())
+    _, after = index.page(limit=5, sort='timestamp')
+    with pytest.raises(ValueError):
+        index.page(limit=5, sort='confidence', after=after, type='url', source='sample')
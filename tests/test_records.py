@@ -0,0 +1,73 @@
+import gc
+import json
+import sys
+import types
+
+import src.store
+from benchmarks.generate import make_threat, write_dataset
+from src.canonical import canonicalize, new_sighting
+from src.records import RecordTable
+from src.store import ThreatStore
+
+COUNT = 50000
+
+# Shared by everything, so not part of any one store's size
+_SKIP = (type, types.ModuleType, types.FunctionType)
+
+
+def deep_size(root):
+    """Bytes held by everything reachable from root (tracemalloc agrees, but is several times slower)"""
+    seen, stack, size = set(), [root], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+        if isinstance(obj, dict):
+            # The garbage collector does not follow str keys
+            stack.extend(obj)
+    return size
+
+
+class DictRecords(dict):
+    """The store's records as they used to be kept: one dict per threat"""
+
+    def items(self, fields=None):
+        return dict.items(self)
+
+    def text(self, field, row):
+        return self[row][field]
+
+
+def table(threats):
+    records = RecordTable()
+    for threat_id, threat in enumerate(threats):
+        records[threat_id] = threat
+    return records
+
+
+def test_store_is_several_times_smaller_than_with_dict_records(tmp_path, monkeypatch):
+    path = str(tmp_path / 'threats.json')
+    write_dataset(path, COUNT)
+    sizes = []
+    for records in (RecordTable, DictRecords):
+        monkeypatch.setattr(src.store, 'RecordTable', records)
+        store = ThreatStore(path)
+        store.refresh()
+        assert type(store._records) is records and len(store._records) == COUNT
+        sizes.append(deep_size(store))
+        del store
+    ratio = sizes[1] / sizes[0]
+    assert ratio >= 5, f"ThreatStore is only {ratio:.1f}x smaller than with dict records"
+
+
+def test_records_read_back_unchanged():
+    threats = [new_sighting(t, canonicalize(t['indicator'])) for t in map(make_threat, range(200))]
+    threats[5]['extra'] = {'nested': [1, 2]}
+    threats[6]['confidence'] = 'high'
+    threats[7]['first_seen'] = 5
+    records = table(json.loads(json.dumps(t)) for t in threats)
+    assert [records[i] for i in range(len(threats))] == threats
+    assert [list(records[i]) for i in range(len(threats))] == [list(t) for t in threats]
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from src.snapshot import Snapshot, main
+from src.store import ThreatStore, stat_signature
+
+from .conftest import indicators, threat
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'threats.json')
+    ThreatStore(path).replace([threat('a.com'), threat('b.com')])
+    assert main([path]) == 0
+    assert main(['--to-json', path + '.bin', str(tmp_path / 'copy.json')]) == 0
+    assert indicators(ThreatStore(str(tmp_path / 'copy.json'))) == ['a.com', 'b.com']
+
+
+def test_to_json_keeps_journaled_writes(tmp_path):
+    path = str(tmp_path / 'threats.json')
+    ThreatStore(path, binary_path=path + '.bin').replace([threat('a.com')])
+    live = ThreatStore(path, binary_path=path + '.bin')
+    live.add_many([threat('b.com'), threat('c.com')])
+    # The binary snapshot predates the journaled writes, so it must not replace the JSON
+    assert main(['--to-json', path + '.bin', path]) == 1
+    assert indicators(ThreatStore(path)) == ['a.com', 'b.com', 'c.com']
+
+    live.compact()
+    assert main([path]) == 0
+    assert main(['--to-json', path + '.bin', path]) == 0
+    assert indicators(ThreatStore(path)) == ['a.com', 'b.com', 'c.com']
+    # The running store notices the rewrite and keeps writing on top of it
+    live.add(threat('d.com'))
+    assert indicators(live) == indicators(ThreatStore(path)) == ['a.com', 'b.com', 'c.com', 'd.com']
+
+
+def test_binary_snapshot_is_in_place_before_the_json_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / 'threats.json')
+    replace, renames = os.replace, []
+
+    def rename(source, target):
+        if target == path:
+            # Other processes must find a binary snapshot of the new JSON snapshot, not parse it
+            with Snapshot(path + '.bin') as binary:
+                renames.append(binary.header['source'] == list(stat_signature(source)))
+        replace(source, target)
+
+    monkeypatch.setattr(os, 'replace', rename)
+    store = ThreatStore(path, binary_path=path + '.bin')
+    store.replace([threat('a.com')])
+    store.add_many([threat('b.com'), threat('c.com')])
+    assert store.compact()
+    assert renames == [True, True]
+    assert indicators(ThreatStore(path, binary_path=path + '.bin')) == ['a.com', 'b.com', 'c.com']
+
+
+def test_json_snapshot_is_parsed_without_the_file_lock(tmp_path, monkeypatch):
+    path = str(tmp_path / 'threats.json')
+    ThreatStore(path).replace([threat('a.com')])
+    read_snapshot = ThreatStore._read_snapshot
+    writes = []
+
+    def parse(store, f):
+        if not writes:
+            writes.append(True)
+            # Another process can still write meanwhile
+            ThreatStore(path).add(threat('b.com'))
+        return read_snapshot(store, f)
+
+    monkeypatch.setattr(ThreatStore, '_read_snapshot', parse)
+    store = ThreatStore(path, binary_path=path + '.bin')
+    store.refresh()
+    # ... and the write is caught up on by the next read
+    assert writes and indicators(store) == ['a.com', 'b.com']
+
+
+def test_binary_snapshot_written_meanwhile_is_kept(tmp_path, monkeypatch):
+    path = str(tmp_path / 'threats.json')
+    ThreatStore(path, binary_path=path + '.bin').replace([threat('a.com')])
+    # As if another worker wrote it while this one was parsing
+    monkeypatch.setattr(ThreatStore, '_restore_binary', lambda store, snapshot, entries: None)
+    monkeypatch.setattr(ThreatStore, '_save_binary', lambda *args: pytest.fail("rewrote the binary snapshot"))
+    assert indicators(ThreatStore(path, binary_path=path + '.bin')) == ['a.com']
@@ -0,0 +1,145 @@
+import json
+import os
+
+import pytest
+
+from src.journal import Journal
+from src.store import ThreatStore
+
+from .conftest import indicators, threat
+
+
+class Crash(Exception):
+    """Stands in for the process dying at a given point"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'threats.json')
+    ThreatStore(path).replace([threat('a.com')])
+    return path
+
+
+def test_journal_is_replayed_on_load(path):
+    ThreatStore(path).add_many([threat('b.com'), threat('c.com')])
+    assert indicators(ThreatStore(path)) == ['a.com', 'b.com', 'c.com']
+
+
+def test_torn_tail_is_dropped(path):
+    store = ThreatStore(path)
+    store.add(threat('b.com'))
+    with open(store.journal.path, 'ab') as f:
+        f.write(b'{"op": "add", "threat": {"indicator": "c.')
+    reloaded = ThreatStore(path)
+    assert indicators(reloaded) == ['a.com', 'b.com']
+    reloaded.add(threat('d.com'))
+    assert indicators(ThreatStore(path)) == ['a.com', 'b.com', 'd.com']
+
+
+def test_stale_journal_is_discarded(path):
+    store = ThreatStore(path)
+    store.add(threat('b.com'))
+    # A collector rewrites the snapshot behind the journal's back
+    with open(path, 'w') as f:
+        json.dump([threat('x.com'), threat('y.com')], f)
+    reloaded = ThreatStore(path)
+    assert indicators(reloaded) == ['x.com', 'y.com']
+    assert not os.path.exists(store.journal.path)
+
+
+def test_replace_from_a_failing_source_keeps_the_old_threats(path):
+    store = ThreatStore(path)
+    store.add(threat('b.com'))
+
+    def feed():
+        yield threat('x.com')
+        raise Crash()
+
+    with pytest.raises(Crash):
+        store.replace(feed())
+    assert not os.path.exists(path + '.tmp')
+    assert indicators(store) == indicators(ThreatStore(path)) == ['a.com', 'b.com']
+    store.replace(threat(name) for name in ('x.com', 'y.com'))
+    assert indicators(store) == indicators(ThreatStore(path)) == ['x.com', 'y.com']
+
+
+def test_crash_before_compacted_snapshot_is_renamed(path, monkeypatch):
+    store = ThreatStore(path)
+    store.add_many([threat('b.com'), threat('c.com')])
+
+    def crash(*args):
+        raise Crash()
+
+    # The first rename in _compact() is the snapshot's; the new journal is already in .tmp
+    monkeypatch.setattr(os, 'replace', crash)
+    with pytest.raises(Crash):
+        store.compact()
+    monkeypatch.undo()
+    assert os.path.exists(store.journal.path + '.tmp')
+    reloaded = ThreatStore(path)
+    assert indicators(reloaded) == ['a.com', 'b.com', 'c.com']
+    assert not os.path.exists(store.journal.path + '.tmp')
+
+
+def test_crash_between_compaction_renames(path, monkeypatch):
+    store = ThreatStore(path)
+    store.add_many([threat('b.com'), threat('c.com')])
+
+    def crash(self):
+        raise Crash()
+
+    monkeypatch.setattr(Journal, 'swap', crash)
+    with pytest.raises(Crash):
+        store.compact()
+    monkeypatch.undo()
+    reloaded = ThreatStore(path)
+    assert indicators(reloaded) == ['a.com', 'b.com', 'c.com']
+    # The new journal was adopted, so the old one's entries are not replayed twice
+    assert reloaded.journal.entries == 0
+    reloaded.add(threat('d.com'))
+    assert indicators(ThreatStore(path)) == ['a.com', 'b.com', 'c.com', 'd.com']
+
+
+@pytest.mark.parametrize('field', ['indicator', 'type', 'source', 'severity', 'sources'])
+def test_unindexable_threat_is_rejected_before_the_journal(path, field):
+    store = ThreatStore(path)
+    with pytest.raises(ValueError):
+        store.add_many([threat('b.com'), threat('bad.com', **{field: {'x': 1}})])
+    assert indicators(store) == ['a.com']
+    assert indicators(ThreatStore(path)) == ['a.com']
+    assert store.stats()['types'] == {'malware': 1}
+
+
+@pytest.mark.parametrize('field', ['indicator', 'type', 'source', 'severity', 'sources'])
+def test_unindexable_threat_in_the_journal_is_skipped(path, field):
+    store = ThreatStore(path)
+    store.add(threat('b.com'))
+    # As journaled by a version that did not validate threats
+    with open(store.journal.path, 'a') as f:
+        f.write(json.dumps({'op': 'add', 'threat': threat('bad.com', **{field: ['x', ['y']]})}) + '\n')
+    store.add(threat('c.com'))
+    for loaded in (store, ThreatStore(path)):
+        assert indicators(loaded) == ['a.com', 'b.com', 'c.com']
+        stats = loaded.stats()
+        assert stats['total'] == sum(stats['types'].values()) == 3
+
+
+def test_lookup_and_match_follow_writes(path):
+    store = ThreatStore(path, binary_path=path + '.bin')
+    store.add_many([threat('evil.com'), threat('10.0.0.0/8'), threat('http://evil.com/x')])
+
+    def matched(store, observable):
+        return [(indicator, [t['indicator'] for t in threats])
+                for found, covering in store.match([observable]) for indicator, threats in covering]
+
+    # Written, reloaded from JSON and journal, and restored from the binary snapshot
+    store.compact()
+    for loaded in (store, ThreatStore(path), ThreatStore(path, binary_path=path + '.bin')):
+        assert [found for found, _ in loaded.lookup(['A.com', 'EVIL.com', 'nope.com'])] == ['A.com', 'EVIL.com']
+        assert matched(loaded, 'cdn.evil.com') == [('evil.com', ['evil.com'])]
+        assert matched(loaded, '10.1.2.3') == [('10.0.0.0/8', ['10.0.0.0/8'])]
+        assert matched(loaded, 'http://evil.com/x') == [('http://evil.com/x', ['http://evil.com/x']),
+                                                        ('evil.com', ['evil.com'])]
+    store.replace([threat('b.com')])
+    assert matched(store, 'x.evil.com') == matched(store, '10.1.2.3') == []
+    assert matched(store, 'x.b.com') == [('b.com', ['b.com'])]